@@ -0,0 +1,184 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import tempfile
+import time
+import pandas as pd
+import filepath
+from periods import parse_quarter
+
+entry_points = ["hpms_enrollment", "med_errors", "pneumo_vacc", "influ_vacc"]
+
+
+def git_commit():
+    """Returns the short hash of the checked out commit, marked if modified."""
+    repo = os.path.dirname(os.path.abspath(__file__))
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=repo,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        modified = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=repo,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+    return commit + ("+" if modified else "")
+
+
+def report_benchmark(quarters, repeat=3):
+    """Times each report entry point against the configured database.
+
+    The query cache is turned off and the database connections are
+    closed between runs, so every run queries the database.
+
+    Args:
+        quarters: list of (quarter, year) tuples to run.
+        repeat: number of runs of each entry point, the fastest is kept.
+
+    Returns:
+        pandas DataFrame of quarter, entry point and seconds.
+    """
+    import query_cache
+    from database import close_connections
+    from filepath import create_dir_if_needed
+    from enrollment import hpms_enrollment
+    from med_errors import med_errors
+    from pneumo import pneumo_vacc
+    from influenza import influ_vacc
+
+    functions = {
+        "hpms_enrollment": hpms_enrollment,
+        "med_errors": med_errors,
+        "pneumo_vacc": pneumo_vacc,
+        "influ_vacc": influ_vacc,
+    }
+
+    query_cache.enabled = False
+
+    results = []
+    for q, yr in quarters:
+        create_dir_if_needed(q, yr)
+
+        for name in entry_points:
+            timings = []
+            for _ in range(repeat):
+                close_connections()
+                start = time.perf_counter()
+                functions[name](q, yr)
+                timings.append(time.perf_counter() - start)
+
+            results.append([f"{yr}Q{q}", name, min(timings)])
+
+    close_connections()
+
+    return pd.DataFrame(results, columns=["quarter", "entry_point", "seconds"])
+
+
+def record_results(results, results_filepath, **details):
+    """Appends benchmark results to a JSON lines file, one line per timing.
+
+    Args:
+        results: pandas DataFrame from report_benchmark.
+        results_filepath: path of the results file.
+        **details: values recorded with every line, i.e. database size.
+    """
+    run = {
+        "commit": git_commit(),
+        "recorded": datetime.datetime.now().isoformat(timespec="seconds"),
+        **details,
+    }
+
+    with open(results_filepath, "a") as results_file:
+        for record in results.to_dict(orient="records"):
+            results_file.write(json.dumps({**run, **record}) + "\n")
+
+
+def compare_results(results_filepath, last=5):
+    """Tabulates the recorded timings of the last commits side by side.
+
+    Returns:
+        pandas DataFrame of seconds, one row per database, quarter and
+        entry point and one column per commit in the order recorded.
+    """
+    records = pd.read_json(results_filepath, lines=True)
+
+    commits = list(dict.fromkeys(records["commit"]))[-last:]
+    records = records[records["commit"].isin(commits)]
+
+    return records.pivot_table(
+        index=["db", "quarter", "entry_point"],
+        columns="commit",
+        values="seconds",
+        aggfunc="min",
+    ).reindex(columns=commits)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--db",
+        default=None,
+        help="Database to benchmark, defaults to a synthetic database",
+    )
+    parser.add_argument(
+        "--members",
+        default=10000,
+        type=int,
+        help="Number of members of the synthetic database",
+    )
+    parser.add_argument(
+        "--quarters",
+        default="2019Q1,2019Q4",
+        help="Comma separated quarters to run, i.e. 2019Q1,2019Q4",
+    )
+    parser.add_argument("--repeat", default=3, type=int, help="Runs per report")
+    parser.add_argument(
+        "--results",
+        default="benchmark_results.jsonl",
+        help="File the results are appended to",
+    )
+    parser.add_argument(
+        "--compare",
+        default=5,
+        type=int,
+        help="Number of recorded commits to compare",
+    )
+
+    arguments = parser.parse_args()
+
+    work_dir = os.path.join(tempfile.gettempdir(), "hpms_benchmark")
+    os.makedirs(work_dir, exist_ok=True)
+
+    db_filepath = arguments.db
+    if db_filepath is None:
+        db_filepath = os.path.join(work_dir, f"synthetic_{arguments.members}.db")
+
+    filepath.configure(db_filepath, os.path.join(work_dir, "output"))
+
+    if not os.path.exists(db_filepath):
+        from synthetic_db import create_database
+        from prepare_db import create_indexes
+
+        create_database(db_filepath, arguments.members)
+        create_indexes(db_filepath)
+
+    quarters = [parse_quarter(quarter) for quarter in arguments.quarters.split(",")]
+    results = report_benchmark(quarters, arguments.repeat)
+
+    record_results(results, arguments.results, db=os.path.basename(db_filepath))
+
+    print(results.to_string(index=False))
+    print(compare_results(arguments.results, arguments.compare).to_string())
@@ -0,0 +1,253 @@
+import argparse
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+from periods import age_cutoff
+from vaccination import classify_frame
+from med_errors import rename_columns, create_tag_cols
+
+centers = ["Providence", "Woonsocket", "Westerly"]
+
+
+def synthetic_vaccinations(members, seed=0):
+    """Creates a vaccination_frame shaped DataFrame of random records.
+
+    Each member has between zero and three vaccination records spread
+    over five years with a mix of vaccinated, refused and contraindicated
+    dose statuses.
+
+    Args:
+        members: number of members to create records for.
+        seed: seed for the random number generator.
+
+    Returns:
+        pandas DataFrame with the columns of vaccination_frame.
+    """
+    rng = np.random.default_rng(seed)
+
+    records = rng.integers(0, 4, size=members)
+    member_ids = np.repeat(np.arange(members), np.maximum(records, 1))
+    has_record = np.repeat(records > 0, np.maximum(records, 1))
+
+    dates = np.datetime64("2015-01-01") + rng.integers(
+        0, 5 * 365, size=len(member_ids)
+    )
+    dose_status = rng.choice([0, 1, 1, 1, 99], size=len(member_ids)).astype(float)
+
+    frame = pd.DataFrame(
+        {
+            "member_id": member_ids,
+            "center": np.array(centers)[member_ids % len(centers)],
+            "enrollment_date": "2010-01-01",
+            "disenrollment_date": None,
+            "dob": None,
+            "dose_status": np.where(has_record, dose_status, np.nan),
+            "date_administered": np.where(has_record, dates.astype(str), None),
+        }
+    )
+    # contraindicated members do not also have a vaccination record
+    contra = frame.loc[frame["dose_status"] == 99, "member_id"]
+    frame.loc[
+        frame["member_id"].isin(contra) & (frame["dose_status"] != 99), "dose_status"
+    ] = 99
+
+    return frame
+
+
+def classification_benchmark(sizes, repeat=3):
+    """Times classify_frame against synthetic frames of increasing size.
+
+    Args:
+        sizes: list of member counts to time.
+        repeat: number of runs per size, the fastest is reported.
+
+    Returns:
+        pandas DataFrame of member count, row count, seconds and
+        seconds per million rows for each size.
+    """
+    params = ("2018-01-01", "2018-03-31")
+    results = []
+
+    for size in sizes:
+        frame = synthetic_vaccinations(size)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            classify_frame(frame, params, centers)
+            timings.append(time.perf_counter() - start)
+
+        seconds = min(timings)
+        results.append([size, len(frame), seconds, seconds / len(frame) * 1e6])
+
+    return pd.DataFrame(
+        results, columns=["members", "rows", "seconds", "seconds_per_million_rows"]
+    )
+
+
+def synthetic_incidents(incidents, seed=0):
+    """Creates a renamed med error DataFrame with random factor flags.
+
+    Args:
+        incidents: number of incidents to create.
+        seed: seed for the random number generator.
+
+    Returns:
+        pandas DataFrame with one 0/1 column per HPMS tag.
+    """
+    rng = np.random.default_rng(seed)
+
+    maps = rename_columns(None, return_maps=True)
+    tag_cols = [tag for tag_map in maps for tag in tag_map.values()]
+
+    flags = (rng.random((incidents, len(tag_cols))) < 0.1).astype(int)
+
+    return pd.DataFrame(flags, columns=tag_cols)
+
+
+def loop_tag_cols(quarter_incidents):
+    """The cell by cell tag builder create_tag_cols replaced, for comparison.
+
+    Med error tags are joined with ", " like create_tag_cols now does.
+    """
+    for tags, tag_map in zip(
+        ["contributing_tags", "med_error_tags", "measures_tags"],
+        rename_columns(None, return_maps=True),
+    ):
+        quarter_incidents[tags] = ""
+
+        for col_name in list(tag_map.values()):
+            indicies = quarter_incidents.loc[
+                quarter_incidents[col_name] == 1
+            ].index.tolist()
+            for i in indicies:
+                if quarter_incidents.at[i, tags] == "":
+                    quarter_incidents.at[i, tags] += col_name
+                else:
+                    quarter_incidents.at[i, tags] += ", " + col_name
+
+    return quarter_incidents
+
+
+def tag_benchmark(incidents=100000):
+    """Times create_tag_cols against the cell by cell loop it replaced.
+
+    Args:
+        incidents: number of synthetic incidents, 100k is about a year
+        for a large organization.
+
+    Returns:
+        pandas DataFrame of seconds for each implementation.
+    """
+    frame = synthetic_incidents(incidents)
+    results = []
+
+    for name, function in [("loop", loop_tag_cols), ("vectorized", create_tag_cols)]:
+        start = time.perf_counter()
+        tagged = function(frame.copy())
+        results.append([name, incidents, time.perf_counter() - start])
+
+        if name == "loop":
+            expected = tagged
+        elif not all(
+            tagged[tags].equals(expected[tags])
+            for tags in ["med_error_tags", "measures_tags", "contributing_tags"]
+        ):
+            raise ValueError("Vectorized tags do not match the loop")
+
+    return pd.DataFrame(results, columns=["implementation", "incidents", "seconds"])
+
+
+def age_filter_benchmark(members=1000000, repeat=3, seed=0):
+    """Times the julianday age filter against the birth date cutoff.
+
+    Both filters count the members at least 65 years old at the end of
+    the quarter in an in-memory database of enrolled members with an
+    indexed demographics table.
+
+    Args:
+        members: number of members in the demographics table.
+        repeat: number of runs per filter, the fastest is reported.
+        seed: seed for the random number generator.
+
+    Returns:
+        pandas DataFrame of members counted and seconds for each filter.
+    """
+    rng = np.random.default_rng(seed)
+    end = "2019-03-31"
+
+    dob = np.datetime64("1920-01-01") + rng.integers(0, 80 * 365, size=members)
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE enrollment (member_id INTEGER, enrollment_date TEXT)")
+    conn.execute("CREATE TABLE demographics (member_id INTEGER PRIMARY KEY, dob TEXT)")
+    conn.executemany(
+        "INSERT INTO enrollment VALUES (?, '2010-01-01')",
+        ((member_id,) for member_id in range(members)),
+    )
+    conn.executemany(
+        "INSERT INTO demographics VALUES (?, ?)", enumerate(dob.astype(str).tolist())
+    )
+    conn.execute("CREATE INDEX idx_demographics_dob ON demographics (dob, member_id)")
+
+    query = """SELECT COUNT(*) FROM enrollment e
+    JOIN demographics d ON e.member_id = d.member_id
+    WHERE e.enrollment_date <= ? {age_filter}"""
+
+    filters = [
+        (
+            "julianday",
+            "AND ((julianday(?) - julianday(d.dob)) / 365.25) >= ?",
+            [end, end, 65],
+        ),
+        ("cutoff", "AND d.dob < ?", [end, age_cutoff(end, 65)]),
+    ]
+
+    results = []
+    for name, age_filter, params in filters:
+        statement = query.format(age_filter=age_filter)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = conn.execute(statement, params).fetchone()[0]
+            timings.append(time.perf_counter() - start)
+        results.append([name, members, count, min(timings)])
+
+    conn.close()
+
+    if results[0][2] != results[1][2]:
+        raise ValueError("Cutoff filter does not match the julianday filter")
+
+    return pd.DataFrame(results, columns=["filter", "members", "eligible", "seconds"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--sizes",
+        default="10000,100000,1000000",
+        help="Comma separated member counts to benchmark",
+    )
+    parser.add_argument("--repeat", default=3, type=int, help="Runs per size")
+    parser.add_argument(
+        "--incidents",
+        default=100000,
+        type=int,
+        help="Number of med error incidents for the tag benchmark",
+    )
+
+    parser.add_argument(
+        "--demographics",
+        default=1000000,
+        type=int,
+        help="Number of members for the age filter benchmark",
+    )
+
+    arguments = parser.parse_args()
+
+    sizes = [int(size) for size in arguments.sizes.split(",")]
+
+    print(classification_benchmark(sizes, arguments.repeat).to_string(index=False))
+    print(tag_benchmark(arguments.incidents).to_string(index=False))
+    print(age_filter_benchmark(arguments.demographics).to_string(index=False))
@@ -0,0 +1,241 @@
+import pathlib
+import sqlite3
+import threading
+import time
+import filepath
+import profiler
+import query_cache
+
+pragmas = {
+    "query_only": "ON",
+    "mmap_size": 268435456,
+    "cache_size": -65536,
+    "temp_store": "MEMORY",
+}
+
+# below SQLite's default limit of 999 bound variables per statement
+member_batch_size = 500
+
+_local = threading.local()
+_lock = threading.Lock()
+_connections = []
+_generation = 0
+_helpers = None
+_stats = {
+    "connections_opened": 0,
+    "connections_closed": 0,
+    "open_seconds": 0.0,
+    "close_seconds": 0.0,
+    "queries": 0,
+}
+
+
+def get_helpers():
+    """Returns the paceutils Helpers instance shared by every module.
+
+    Only used for its quarter date helpers, queries go through
+    fetchall_query and dataframe_query.
+    """
+    global _helpers
+
+    with _lock:
+        if _helpers is None:
+            from paceutils import Helpers
+
+            _helpers = Helpers(filepath.db_filepath)
+
+    return _helpers
+
+
+def database_uri(db_filepath):
+    """Returns the read-only SQLite URI of the database file.
+
+    The path is made absolute but not resolved, resolving turns a mapped
+    network drive such as V: into a UNC path. SQLite rejects a URI with a
+    server name, so a UNC path is opened as a plain path instead and only
+    query_only keeps the connection from writing.
+    """
+    path = pathlib.Path(db_filepath).absolute()
+    uri = path.as_uri()
+
+    if not uri.startswith("file:///"):
+        return str(path)
+
+    return uri + "?mode=ro"
+
+
+def connect(db_filepath=None):
+    """Opens a read-only connection tuned for the report queries.
+
+    The connection keeps up to 256 prepared statements cached so
+    queries repeated across stages are not parsed again.
+
+    Args:
+        db_filepath: path to the SQLite database, defaults to the one
+        in filepath.py.
+
+    Returns:
+        sqlite3 Connection.
+    """
+    if db_filepath is None:
+        db_filepath = filepath.db_filepath
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(
+        database_uri(db_filepath),
+        uri=True,
+        check_same_thread=False,
+        cached_statements=256,
+    )
+    for pragma, value in pragmas.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+    with _lock:
+        _stats["connections_opened"] += 1
+        _stats["open_seconds"] += time.perf_counter() - start
+
+    return conn
+
+
+def connection():
+    """Returns the pooled connection of the current thread, opening it if needed."""
+    generation, conn = getattr(_local, "conn", (None, None))
+
+    if generation != _generation:
+        conn = connect()
+        _local.conn = (_generation, conn)
+        with _lock:
+            _connections.append(conn)
+
+    return conn
+
+
+def close_connections():
+    """Closes every pooled connection, later queries open new ones."""
+    global _generation
+
+    with _lock:
+        conns = list(_connections)
+        _connections.clear()
+        _generation += 1
+
+    for conn in conns:
+        start = time.perf_counter()
+        conn.close()
+        with _lock:
+            _stats["connections_closed"] += 1
+            _stats["close_seconds"] += time.perf_counter() - start
+
+
+def fetchall_query(query, params=()):
+    """Runs the query on the pooled connection and returns all rows.
+
+    Results are served from query_cache while the database is unchanged.
+    """
+
+    def run():
+        with _lock:
+            _stats["queries"] += 1
+
+        with profiler.span("query", " ".join(query.split())) as event:
+            rows = connection().execute(query, params).fetchall()
+            event["rows"] = len(rows)
+
+        return rows
+
+    return query_cache.cached("fetchall", query, params, run)
+
+
+def dataframe_query(query, params=()):
+    """Runs the query on the pooled connection and returns a pandas DataFrame.
+
+    Results are served from query_cache while the database is unchanged.
+    """
+
+    def run():
+        import pandas as pd
+
+        with _lock:
+            _stats["queries"] += 1
+
+        with profiler.span("query", " ".join(query.split())) as event:
+            frame = pd.read_sql_query(query, connection(), params=params)
+            event["rows"] = len(frame)
+
+        return frame
+
+    return query_cache.cached("dataframe", query, params, run)
+
+
+def dataframe_chunks(query, params=(), chunksize=10000):
+    """Runs the query on the pooled connection and yields its rows in chunks.
+
+    Only one chunk of rows is held at a time, at least one (possibly
+    empty) DataFrame is yielded. Chunked results bypass query_cache.
+
+    Args:
+        query: SQL query string.
+        params: query parameters.
+        chunksize: number of rows per DataFrame.
+
+    Yields:
+        pandas DataFrames of up to chunksize rows.
+    """
+    import pandas as pd
+
+    with _lock:
+        _stats["queries"] += 1
+
+    cursor = connection().execute(query, params)
+    columns = [column[0] for column in cursor.description]
+
+    while True:
+        with profiler.span("query", " ".join(query.split())) as event:
+            rows = cursor.fetchmany(chunksize)
+            event["rows"] = len(rows)
+
+        yield pd.DataFrame.from_records(rows, columns=columns)
+
+        if len(rows) < chunksize:
+            break
+
+
+def member_dataframe_query(query, member_ids, params=()):
+    """Runs a query for any number of members in fixed-size batches.
+
+    The query's {member_ids} placeholder is filled with member_batch_size
+    bound parameters and the last batch is padded with NULLs, so every
+    batch runs the same cached statement and query plan however many
+    members are looked up. The member id parameters come after params.
+
+    Args:
+        query: SQL with an IN ({member_ids}) clause.
+        member_ids: iterable of member ids, duplicates are ignored.
+        params: parameters for the placeholders before the member ids.
+
+    Returns:
+        pandas DataFrame of the rows of every batch.
+    """
+    import pandas as pd
+
+    members = sorted(set(int(member_id) for member_id in member_ids))
+    batch_query = query.format(member_ids=", ".join(["?"] * member_batch_size))
+
+    batches = []
+    for start in range(0, max(len(members), 1), member_batch_size):
+        batch = members[start : start + member_batch_size]
+        batch += [None] * (member_batch_size - len(batch))
+        batches.append(dataframe_query(batch_query, list(params) + batch))
+
+    return pd.concat(batches, ignore_index=True)
+
+
+def connection_stats():
+    """Returns a copy of the connection counts and timings and the cache counts."""
+    with _lock:
+        stats = dict(_stats)
+        stats["connections_open"] = len(_connections)
+
+    stats.update(query_cache.cache_stats())
+
+    return stats
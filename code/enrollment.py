@@ -1,104 +1,287 @@
 import argparse
-from collections import defaultdict
 import pandas as pd
-from filepath import filepath, create_dir_if_needed, db_filepath
-from paceutils import CenterEnrollment, Enrollment
-
-
-def enrollment_data(params):
-
-    centers = ["Providence", "Woonsocket", "Westerly"]
-
-    center_enrollment = CenterEnrollment(db_filepath)
-
-    enrollment_dict = defaultdict(list)
-
-    for center in centers:
-        enrollment_dict[center].append(
-            center_enrollment.census_during_period(params, center)
-        )
-
-        enrollment_dict[center].append(center_enrollment.enrolled(params, center))
-        enrollment_dict[center].append(center_enrollment.dual_enrolled(params, center))
-        enrollment_dict[center].append(
-            center_enrollment.medicare_only_enrolled(params, center)
-        )
-        enrollment_dict[center].append(
-            center_enrollment.medicaid_only_enrolled(params, center)
-        )
-        enrollment_dict[center].append(
-            center_enrollment.private_pay_enrolled(params, center)
-        )
-
-        enrollment_dict[center].append(center_enrollment.disenrolled(params, center))
-        enrollment_dict[center].append(
-            center_enrollment.dual_disenrolled(params, center)
-        )
-        enrollment_dict[center].append(
-            center_enrollment.medicare_only_disenrolled(params, center)
-        )
-        enrollment_dict[center].append(
-            center_enrollment.medicaid_only_disenrolled(params, center)
-        )
-        enrollment_dict[center].append(
-            center_enrollment.private_pay_disenrolled(params, center)
-        )
-
-        enrollment_dict[center].append(center_enrollment.deaths(params, center))
-
-    rows = [
-        "Census",
-        "Enrolled",
-        "Dual",
-        "Medicare",
-        "Medicaid",
-        "Private Pay",
-        "Disenrolled",
-        "Dual",
-        "Medicare",
-        "Medicaid",
-        "Private Pay",
-        "Deaths",
+import profiler
+import status_store
+import history_store
+import filepath
+from filepath import create_dir_if_needed
+from database import (
+    get_helpers,
+    dataframe_query,
+    fetchall_query,
+    member_dataframe_query,
+)
+from sites import report_centers
+from periods import dates_between, enrolled_during, enrolled_filter
+
+enrollment_query = f"""
+    SELECT member_id, center, enrollment_date, disenrollment_date,
+    disenroll_type, medicare, medicaid
+    FROM enrollment
+    WHERE {enrolled_filter()}
+    """
+
+enrollment_member_query = enrollment_query + "AND member_id IN ({member_ids})"
+
+# enrollment records counted in the rows double_check compares, counted
+# in SQL so the check does not share enrollment_masks with the report.
+# The unary + keeps SQLite from grouping the members by walking the whole
+# member_id index instead of reading the date range of each row
+organization_filters = {
+    "Census": enrolled_filter(),
+    "Enrolled": "enrollment_date BETWEEN ? AND ?",
+    "Disenrolled": "disenrollment_date BETWEEN ? AND ?",
+    "Deaths": "disenrollment_date BETWEEN ? AND ? AND disenroll_type = 'Deceased'",
+}
+
+organization_query = "\n    UNION ALL\n".join(
+    f"""
+    SELECT '{row}', COUNT(*), COALESCE(SUM(centers - 1), 0) FROM (
+        SELECT COUNT(DISTINCT center) AS centers FROM enrollment
+        WHERE {where}
+        GROUP BY +member_id
+    )"""
+    for row, where in organization_filters.items()
+)
+
+hpms_rows = [
+    "Census",
+    "Enrolled",
+    "Dual",
+    "Medicare",
+    "Medicaid",
+    "Private Pay",
+    "Disenrolled",
+    "Dual",
+    "Medicare",
+    "Medicaid",
+    "Private Pay",
+    "Deaths",
+]
+
+
+def enrollment_frame(params):
+    """Pulls every enrollment record that overlaps the period in one query.
+
+    Args:
+        params: tuple of start and end date of the period.
+
+    Returns:
+        pandas DataFrame of enrollment records.
+    """
+    return dataframe_query(enrollment_query, params)
+
+
+def enrollment_masks(enrollments, params):
+    """Flags the enrollment records counted in each row of the HPMS table.
+
+    Args:
+        enrollments: pandas DataFrame from enrollment_frame, may cover
+        more than the period.
+        params: tuple of start and end date of the period.
+
+    Returns:
+        list of (row name, boolean pandas Series) in HPMS table order.
+    """
+    start, end = str(params[0]), str(params[1])
+
+    enrollment_date = enrollments["enrollment_date"]
+    disenrollment_date = enrollments["disenrollment_date"]
+
+    census = enrolled_during(enrollments, params)
+    enrolled = dates_between(enrollment_date, start, end)
+    disenrolled = dates_between(disenrollment_date, start, end)
+
+    medicare = enrollments["medicare"] == 1
+    medicaid = enrollments["medicaid"] == 1
+
+    dual = medicare & medicaid
+    medicare_only = medicare & ~medicaid
+    medicaid_only = ~medicare & medicaid
+    private_pay = ~medicare & ~medicaid
+
+    masks = [
+        census,
+        enrolled,
+        enrolled & dual,
+        enrolled & medicare_only,
+        enrolled & medicaid_only,
+        enrolled & private_pay,
+        disenrolled,
+        disenrolled & dual,
+        disenrolled & medicare_only,
+        disenrolled & medicaid_only,
+        disenrolled & private_pay,
+        disenrolled & (enrollments["disenroll_type"] == "Deceased"),
     ]
 
-    return pd.DataFrame.from_dict(enrollment_dict).set_index(pd.Index(rows))
+    return list(zip(hpms_rows, masks))
+
+
+def enrollment_data(enrollments, params):
+    """Counts the members in each row of the HPMS table for every center.
+
+    Each center counts its distinct members, a member with several
+    enrollment records at the center (re-enrolled) is counted once.
+
+    Args:
+        enrollments: pandas DataFrame from enrollment_frame.
+        params: tuple of start and end date of the period.
+
+    Returns:
+        pandas DataFrame where each row is an enrollment measure and
+        each column is a center.
+    """
+    centers = report_centers(params)
+
+    masks = enrollment_masks(enrollments, params)
+
+    center_counts = [
+        enrollments.loc[mask].groupby("center")["member_id"].nunique()
+        for _, mask in masks
+    ]
+
+    rows = [row for row, _ in masks]
+
+    return (
+        pd.DataFrame(center_counts)
+        .reindex(columns=centers)
+        .fillna(0)
+        .astype(int)
+        .set_index(pd.Index(rows))
+    )
+
+
+def organization_totals(params):
+    """Counts the members in the checked rows across every center.
 
+    Members are counted once across the organization, as the original
+    Enrollment queries did. A member enrolled at more than one center
+    during the period (moved to another center) is counted at each of
+    them in the report, these extra center counts are the transfers.
 
-def double_check(df, params):
-    enroll = Enrollment(db_filepath)
+    Args:
+        params: tuple of start and end date of the period.
+
+    Returns:
+        dict of row name to a tuple of number of members and transfers.
+    """
+    rows = fetchall_query(organization_query, list(params) * len(organization_filters))
+
+    return {row: (members, transfers) for row, members, transfers in rows}
+
+
+def double_check(df, organization):
+    """Checks the center counts against organization wide totals.
+
+    Each checked row of every center added up must equal the members of
+    the organization plus the members counted again at another center,
+    so members at a center missing from the report columns, or counted
+    in the wrong row, fail the check.
+
+    Args:
+        df: pandas DataFrame from enrollment_data.
+        organization: dict from organization_totals.
+
+    Returns:
+        string naming the number of transfers.
+    """
     totals = df.sum(axis=1)
 
-    if totals["Census"] != enroll.census_during_period(params):
-        raise ValueError("Census does not match")
+    messages = {
+        "Census": "Census does not match",
+        "Enrolled": "Enrolled does not match",
+        "Disenrolled": "Disenrolled does not match",
+        "Deaths": "Deaths do not match",
+    }
+
+    for row, message in messages.items():
+        members, transfers = organization[row]
+        if totals[row] != members + transfers:
+            raise ValueError(
+                f"{message}: {totals[row]} counted at the centers, "
+                f"{members} members and {transfers} transfers"
+            )
+
+    return f"Double check complete, {organization['Census'][1]} transfers"
+
+
+def enrollment_status(enrollments, params):
+    """Lists the HPMS table rows each member is counted in by center.
+
+    Rows are stored by their position in enrollment_masks, as the payer
+    row names repeat for enrolled and disenrolled members.
+
+    Returns:
+        pandas DataFrame of member_id, center and bucket rows.
+    """
+    return pd.concat(
+        [
+            enrollments.loc[mask, ["member_id", "center"]].assign(bucket=str(position))
+            for position, (_, mask) in enumerate(enrollment_masks(enrollments, params))
+        ],
+        ignore_index=True,
+    )
+
 
-    if totals["Enrolled"] != enroll.enrolled(params):
-        raise ValueError("Enrolled does not match")
+def stored_enrollment_data(params):
+    """Counts enrollment through the status store instead of from scratch.
 
-    if totals["Disenrolled"] != enroll.disenrolled(params):
-        raise ValueError("Disenrolled does not match")
+    Only members with enrollment rows added since the store was last
+    updated for the period are counted again.
 
-    if totals["Deaths"] != enroll.deaths(params):
-        raise ValueError("Deaths do not match")
+    Args:
+        params: tuple of start and end date of the period.
 
-    return "Double check complete"
+    Returns:
+        pandas DataFrame like enrollment_data.
+    """
+    centers = report_centers(params)
 
+    def fetch(member_ids):
+        if member_ids is None:
+            return enrollment_frame(params)
 
-def hpms_enrollment(quarter=None, year=None):
-    enroll = Enrollment(db_filepath)
+        return member_dataframe_query(enrollment_member_query, member_ids, params)
+
+    def classify(enrollments):
+        return enrollment_status(enrollments, params)
+
+    status_store.update_status("enrollment", params, ["enrollment"], fetch, classify)
+
+    positions = [str(position) for position in range(len(hpms_rows))]
+
+    enrollment_df = status_store.status_counts("enrollment", params, positions, centers)
+    enrollment_df.index = pd.Index(hpms_rows)
+    enrollment_df.columns.name = None
+
+    return enrollment_df
+
+
+def hpms_enrollment(quarter=None, year=None, enrollments=None):
+    helpers = get_helpers()
 
     if quarter is None:
-        params = enroll.last_quarter()
-        quarter, year = enroll.last_quarter(return_q=True)
+        params = helpers.last_quarter()
+        quarter, year = helpers.last_quarter(return_q=True)
     else:
-        params = enroll.get_quarter_dates(quarter, year)
+        params = helpers.get_quarter_dates(quarter, year)
 
-    enrollment_df = enrollment_data(params)
+    if status_store.enabled and enrollments is None:
+        enrollment_df = stored_enrollment_data(params)
+    else:
+        if enrollments is None:
+            enrollments = enrollment_frame(params)
 
-    double_check(enrollment_df, params)
+        enrollment_df = enrollment_data(enrollments, params)
 
-    enrollment_df.to_csv(
-        f"{filepath}\\{year}Q{quarter}\\hpms_enrollment_Q{quarter}_{year}.csv"
-    )
+    double_check(enrollment_df, organization_totals(params))
+
+    path = f"{filepath.filepath}\\{year}Q{quarter}\\hpms_enrollment_Q{quarter}_{year}.csv"
+    with profiler.span("write", path, rows=len(enrollment_df)):
+        enrollment_df.to_csv(path)
+
+    history_store.write_counts("enrollment", enrollment_df, quarter, year)
 
     return "Enrollment Complete!"
 
@@ -109,7 +292,19 @@ if __name__ == "__main__":
     parser.add_argument("--quarter", default=None, help="Number of quarter")
     parser.add_argument("--year", default=None, help="Year of quarter")
 
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time queries and file writes and write a trace file",
+    )
+
     arguments = parser.parse_args()
 
-    create_dir_if_needed(**vars(arguments))
-    hpms_enrollment(**vars(arguments))
+    profiler.enabled = arguments.profile
+
+    create_dir_if_needed(arguments.quarter, arguments.year)
+    with profiler.span("stage", "hpms_enrollment"):
+        hpms_enrollment(arguments.quarter, arguments.year)
+
+    if arguments.profile:
+        profiler.report()
@@ -1,14 +1,33 @@
 import os
-from paceutils import Helpers
 
-filepath = "C:\\Users\\snelson\\repos\\hpms_reporting\\output"
-db_filepath = "V:\\Databases\\PaceDashboard.db"
+filepath = os.environ.get(
+    "HPMS_OUTPUT", "C:\\Users\\snelson\\repos\\hpms_reporting\\output"
+)
+db_filepath = os.environ.get("HPMS_DB", "V:\\Databases\\PaceDashboard.db")
+contract = os.environ.get("HPMS_CONTRACT", "H4105")
+
+
+def configure(db=None, output=None, contract_number=None):
+    """Points the reports at another database, output folder or contract.
+
+    The report modules read filepath.filepath and filepath.contract when
+    they write, so later reports use the new values.
+    """
+    global filepath, db_filepath, contract
+
+    if db is not None:
+        db_filepath = db
+    if output is not None:
+        filepath = output
+    if contract_number is not None:
+        contract = contract_number
 
 
 def create_dir_if_needed(quarter=None, year=None):
     if quarter is None:
-        helpers = Helpers(db_filepath)
-        quarter, year = helpers.last_quarter(return_q=True)
+        from database import get_helpers
+
+        quarter, year = get_helpers().last_quarter(return_q=True)
 
     if not os.path.exists(f"{filepath}\\{year}Q{quarter}"):
         os.makedirs(f"{filepath}\\{year}Q{quarter}")
@@ -0,0 +1,197 @@
+import argparse
+import json
+import multiprocessing
+import time
+import filepath
+
+
+def load_manifest(manifest_filepath):
+    """Reads the organizations to report on from a JSON manifest.
+
+    The manifest is a list of objects with the db, contract and output
+    of each organization, and optionally a name (defaults to contract),
+    an organization_name for site names and a sites registry replacing
+    sites.site_registry. An entry with an organization_name but no sites
+    names every center after the organization:
+
+        [{"name": "Rhode Island", "db": "V:\\\\Databases\\\\PaceDashboard.db",
+          "contract": "H4105", "output": "C:\\\\hpms\\\\H4105"},
+         {"name": "Other", "db": "W:\\\\Other.db", "contract": "H0000",
+          "output": "C:\\\\hpms\\\\H0000", "organization_name": "PACE Other"}]
+
+    Returns:
+        list of organization dicts.
+    """
+    with open(manifest_filepath) as manifest_file:
+        organizations = json.load(manifest_file)
+
+    for organization in organizations:
+        missing = [
+            key for key in ["db", "contract", "output"] if key not in organization
+        ]
+        if missing:
+            raise ValueError(f"Manifest entry {organization} is missing {missing}")
+        organization.setdefault("name", organization["contract"])
+
+    names = [organization["name"] for organization in organizations]
+    if len(set(names)) != len(names):
+        raise ValueError("Manifest names must be unique")
+
+    return organizations
+
+
+def run_organization(organization, q=None, yr=None, jobs=1):
+    """Runs every report for one organization, in its own worker process.
+
+    Any error is returned in the summary instead of raised, so one
+    organization failing does not stop the others.
+
+    Returns:
+        dict of name, contract, seconds, error and the stages run.
+    """
+    start = time.perf_counter()
+    summary = {
+        "name": organization["name"],
+        "contract": organization["contract"],
+        "stages": [],
+        "error": None,
+    }
+
+    try:
+        filepath.configure(
+            organization["db"], organization["output"], organization["contract"]
+        )
+
+        import sites
+        from run_hpms_reporting import hpms_reporting_wrapper
+        from database import close_connections
+
+        if "organization_name" in organization:
+            sites.organization_name = organization["organization_name"]
+            # the Rhode Island centers are not this organization's
+            sites.site_registry = {}
+        if "sites" in organization:
+            sites.site_registry = organization["sites"]
+
+        try:
+            results = hpms_reporting_wrapper(q, yr, jobs)
+        finally:
+            close_connections()
+
+        for name, seconds, result in results:
+            failed = isinstance(result, Exception)
+            summary["stages"].append(
+                {
+                    "stage": name,
+                    "seconds": seconds,
+                    "failed": failed,
+                    "result": (
+                        f"{type(result).__name__}: {result}" if failed else result
+                    ),
+                }
+            )
+    except Exception as error:
+        summary["error"] = f"{type(error).__name__}: {error}"
+
+    summary["seconds"] = time.perf_counter() - start
+
+    return summary
+
+
+def run_fleet(organizations, q=None, yr=None, processes=2, jobs=1):
+    """Runs every report for each organization on a pool of processes.
+
+    Each organization runs in a fresh process, so its database, output
+    folder and contract never leak into another organization's reports.
+
+    Args:
+        organizations: list of organization dicts from load_manifest.
+        q: quarter to run, defaults to each database's last quarter.
+        yr: year of the quarter.
+        processes: number of organizations to run at the same time.
+        jobs: number of report stages to run at the same time within
+        an organization.
+
+    Returns:
+        list of run_organization summaries in manifest order.
+    """
+    with multiprocessing.Pool(processes, maxtasksperchild=1) as pool:
+        runs = [
+            pool.apply_async(run_organization, (organization, q, yr, jobs))
+            for organization in organizations
+        ]
+
+        return [run.get() for run in runs]
+
+
+def organization_failed(summary):
+    """Checks if the organization or any of its stages failed."""
+    return summary["error"] is not None or any(
+        stage["failed"] for stage in summary["stages"]
+    )
+
+
+def fleet_summary(summaries):
+    """Formats the run of every organization, one line per stage."""
+    lines = []
+    for summary in summaries:
+        status = "FAILED" if organization_failed(summary) else "ok"
+        organization = f"{summary['name']} ({summary['contract']})"
+        lines.append(f"{organization:<28}{summary['seconds']:>8.2f}s  {status}")
+        if summary["error"] is not None:
+            lines.append(f"    {summary['error']}")
+        for stage in summary["stages"]:
+            lines.append(
+                f"    {stage['stage']:<24}{stage['seconds']:>8.2f}s  {stage['result']}"
+            )
+
+    failures = sum(organization_failed(summary) for summary in summaries)
+    lines.append(
+        f"{len(summaries) - failures} of {len(summaries)} organizations complete"
+    )
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("manifest", help="JSON manifest of databases to report on")
+    parser.add_argument("--q", default=None, type=int, help="Number of quarter")
+    parser.add_argument("--yr", default=None, type=int, help="Year of quarter")
+    parser.add_argument(
+        "--processes",
+        default=2,
+        type=int,
+        help="Number of organizations to run at the same time",
+    )
+    parser.add_argument(
+        "--jobs",
+        default=1,
+        type=int,
+        help="Number of report stages to run at the same time per organization",
+    )
+    parser.add_argument(
+        "--summary",
+        default=None,
+        help="File to write the run summary to as JSON",
+    )
+
+    arguments = parser.parse_args()
+
+    summaries = run_fleet(
+        load_manifest(arguments.manifest),
+        arguments.q,
+        arguments.yr,
+        arguments.processes,
+        arguments.jobs,
+    )
+
+    if arguments.summary is not None:
+        with open(arguments.summary, "w") as summary_file:
+            json.dump(summaries, summary_file, indent=2)
+
+    print(fleet_summary(summaries))
+
+    if any(organization_failed(summary) for summary in summaries):
+        raise SystemExit("One or more organizations failed")
@@ -0,0 +1,278 @@
+import argparse
+import contextlib
+import os
+import threading
+import filepath
+import profiler
+from periods import parse_quarter
+
+# every run also writes its HPMS tables to Parquet files partitioned by
+# year and quarter in the output folder, needs pyarrow
+enabled = True
+
+# one dataset per report, re-running a report replaces its own partition
+datasets = ["enrollment", "pneumo", "influ", "med_errors"]
+
+_lock = threading.Lock()
+_missing_reported = False
+
+
+def history_filepath(dataset):
+    """Returns the folder of the dataset, in the output folder."""
+    return f"{filepath.filepath}\\history\\{dataset}"
+
+
+def partition_filepath(dataset, quarter, year):
+    """Returns the folder of the dataset's partition for the quarter."""
+    return os.path.join(
+        history_filepath(dataset), f"year={int(year)}", f"quarter={int(quarter)}"
+    )
+
+
+def parquet():
+    """Imports pyarrow.parquet, or returns None if pyarrow is not installed."""
+    global _missing_reported
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        with _lock:
+            if not _missing_reported:
+                print("pyarrow is not installed, the history store is skipped")
+                _missing_reported = True
+        return None
+
+    return pq
+
+
+def arrow_table(frame):
+    """Converts a DataFrame to a pyarrow Table for the history store.
+
+    Numeric columns keep their type and every other column (text and
+    categories) is stored as strings, so the partitions of every quarter
+    have the same schema.
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    arrays = []
+    for col in frame.columns:
+        values = frame[col]
+        if pd.api.types.is_numeric_dtype(values):
+            arrays.append(pa.array(values, from_pandas=True))
+        else:
+            strings = values.astype(str).where(values.notna(), None)
+            arrays.append(pa.array(strings, type=pa.string(), from_pandas=True))
+
+    return pa.Table.from_arrays(arrays, names=[str(col) for col in frame.columns])
+
+
+@contextlib.contextmanager
+def partition_writer(dataset, quarter, year):
+    """Replaces the dataset's partition for the quarter with the rows written.
+
+    Yields a function of a DataFrame that appends its rows to the
+    partition, so large tables can be written a chunk at a time. The new
+    partition replaces the old one once the with block finishes, a
+    quarter without rows has its partition removed.
+
+    Does nothing when the store is disabled or pyarrow is not installed.
+    """
+    pq = parquet() if enabled else None
+    if pq is None:
+        yield lambda frame: None
+        return
+
+    path = partition_filepath(dataset, quarter, year)
+    part_filepath = os.path.join(path, "part-0.parquet")
+    # files starting with _ are skipped by readers until renamed
+    temp_filepath = os.path.join(
+        path, f"_part-0.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    os.makedirs(path, exist_ok=True)
+
+    writer = None
+    rows = 0
+
+    def write(frame):
+        nonlocal writer, rows
+
+        if frame.empty:
+            return
+
+        table = arrow_table(frame)
+        if writer is None:
+            writer = pq.ParquetWriter(temp_filepath, table.schema)
+        writer.write_table(table)
+        rows += len(frame)
+
+    try:
+        yield write
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(temp_filepath)
+        raise
+
+    with profiler.span("write", part_filepath, rows=rows):
+        if writer is not None:
+            writer.close()
+            os.replace(temp_filepath, part_filepath)
+        elif os.path.exists(part_filepath):
+            os.remove(part_filepath)
+
+
+def write_counts(dataset, df, quarter, year):
+    """Stores a report table of counts (rows by center) for the quarter.
+
+    The table is stored in long format with contract, row, measure,
+    center and value columns, i.e. the Census row of the Providence column
+    of the enrollment report becomes ("H4105", 0, "Census", "Providence",
+    508). row is the position of the row in the report, labels such as
+    Dual appear more than once in the enrollment report.
+    """
+    counts = df.rename_axis("measure").reset_index()
+    counts.insert(0, "row", range(len(counts)))
+    counts = counts.melt(
+        id_vars=["row", "measure"], var_name="center", value_name="value"
+    )
+    counts.insert(0, "contract", filepath.contract)
+
+    with partition_writer(dataset, quarter, year) as write:
+        write(counts)
+
+
+def quarter_filters(start=None, end=None):
+    """Builds the partition filters of the quarters from start to end.
+
+    Args:
+        start: first quarter as a (quarter, year) tuple, or None for
+        every earlier quarter.
+        end: last quarter as a (quarter, year) tuple, or None for every
+        later quarter.
+
+    Returns:
+        list of lists of (column, op, value) tuples, any of the inner
+        lists must match (pyarrow's disjunctive normal form).
+    """
+    if start is None and end is None:
+        return [[]]
+
+    if start is None:
+        end_q, end_yr = end
+        return [
+            [("year", "<", end_yr)],
+            [("year", "=", end_yr), ("quarter", "<=", end_q)],
+        ]
+
+    start_q, start_yr = start
+    if end is None:
+        return [
+            [("year", ">", start_yr)],
+            [("year", "=", start_yr), ("quarter", ">=", start_q)],
+        ]
+
+    end_q, end_yr = end
+    if start_yr == end_yr:
+        return [
+            [
+                ("year", "=", start_yr),
+                ("quarter", ">=", start_q),
+                ("quarter", "<=", end_q),
+            ]
+        ]
+
+    return [
+        [("year", "=", start_yr), ("quarter", ">=", start_q)],
+        [("year", ">", start_yr), ("year", "<", end_yr)],
+        [("year", "=", end_yr), ("quarter", "<=", end_q)],
+    ]
+
+
+def read_history(dataset, start=None, end=None, columns=None, filters=None):
+    """Loads the dataset's rows for the quarters from start to end.
+
+    Only the partitions of those quarters are opened, filters are pushed
+    down to the Parquet row groups and the files are memory mapped.
+
+    Args:
+        dataset: one of datasets.
+        start: first quarter, written as {year}Q{quarter}, defaults to
+        the first quarter stored.
+        end: last quarter, written as {year}Q{quarter}, defaults to the
+        last quarter stored.
+        columns: list of columns to load, defaults to every column.
+        filters: list of (column, op, value) tuples every row must match,
+        i.e. [("center", "=", "Providence")].
+
+    Returns:
+        pandas DataFrame of the rows with year and quarter columns.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    path = history_filepath(dataset)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=(columns or []) + ["year", "quarter"])
+
+    dnf = [
+        conjunction + list(filters or [])
+        for conjunction in quarter_filters(
+            parse_quarter(start) if start else None, parse_quarter(end) if end else None
+        )
+    ]
+
+    if columns is not None:
+        columns = list(columns) + ["year", "quarter"]
+
+    table = pq.read_table(
+        path,
+        columns=columns,
+        filters=dnf if any(dnf) else None,
+        partitioning=ds.partitioning(
+            pa.schema([("year", pa.int32()), ("quarter", pa.int32())]), flavor="hive"
+        ),
+        memory_map=True,
+    )
+
+    return (
+        table.to_pandas()
+        .sort_values(["year", "quarter"], kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("dataset", choices=datasets, help="Dataset to load")
+    parser.add_argument(
+        "--from", dest="start", default=None, help="First quarter, i.e. 2018Q1"
+    )
+    parser.add_argument("--to", dest="end", default=None, help="Last quarter")
+    parser.add_argument(
+        "--columns", default=None, help="Comma separated columns to load"
+    )
+
+    arguments = parser.parse_args()
+
+    history = read_history(
+        arguments.dataset,
+        arguments.start,
+        arguments.end,
+        arguments.columns.split(",") if arguments.columns else None,
+    )
+
+    if "value" in history.columns:
+        print(
+            history.pivot_table(
+                index=["row", "measure", "center"],
+                columns=["year", "quarter"],
+                values="value",
+                aggfunc="sum",
+            ).to_string()
+        )
+    else:
+        print(history.to_string(index=False))
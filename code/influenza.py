@@ -1,12 +1,29 @@
-import csv
+import numpy as np
 import pandas as pd
 import datetime
-from filepath import filepath, create_dir_if_needed, db_filepath
-from paceutils import Helpers
-import os
+import functools
+import profiler
+import filepath
+import query_cache
+from filepath import create_dir_if_needed
+from periods import shift_date
+from database import get_helpers
+from sites import report_centers
+import status_store
+import history_store
+from vaccination import (
+    vaccination_frame,
+    vaccination_window,
+    classify_frame,
+    stored_buckets,
+    stored_counts,
+    bucket_counts,
+    missed_list_for_nursing,
+    stored_missed_lists,
+)
 import argparse
 
-helpers = Helpers(db_filepath)
+influ_rows = ["eligible", "vacc_during", "vacc_prior", "refused", "contra", "missed"]
 
 
 def flu_season_dates(year=None):
@@ -19,185 +36,144 @@ def flu_season_dates(year=None):
     return start_date, end_date
 
 
-def eligible(params, center):
-    params = list(params) + [center]
-    query = """
-    SELECT DISTINCT(e.member_id)
-    FROM enrollment e
-    WHERE (disenrollment_date >=?
-    OR disenrollment_date IS NULL)
-    AND enrollment_date <= ?
-    AND e.center = ?
-    """
-
-    return helpers.fetchall_query(query, params)
-
+def flu_season_year(quarter, year):
+    """Returns the year the flu season covering the quarter ends in.
 
-def during(params, center):
-    params = list(params) + list(params) + [center]
-
-    query = """
-    SELECT DISTINCT(e.member_id)
-    FROM enrollment e
-    LEFT JOIN influ v on e.member_id = v.member_id
-    WHERE (disenrollment_date >=?
-    OR disenrollment_date IS NULL)
-    AND enrollment_date <= ?
-    AND dose_status = 1
-    AND date_administered BETWEEN ? AND date(?, '+1 day')
-    AND e.center = ?
+    Q4 belongs to the season ending the next March, every other quarter
+    to the season ending in its own year.
     """
+    if int(quarter) == 4:
+        return int(year) + 1
 
-    return helpers.fetchall_query(query, params)
-
+    return int(year)
 
-def prior(params, center):
 
-    params = list(params) + [params[0], params[0]] + [center]
-
-    query = """
-    SELECT DISTINCT(e.member_id)
-    FROM enrollment e
-    LEFT JOIN influ v on e.member_id = v.member_id
-    WHERE (disenrollment_date >=?
-    OR disenrollment_date IS NULL)
-    AND enrollment_date <= ?
-    AND dose_status = 1
-    AND date_administered BETWEEN date(?, '-2 months') AND ?
-    AND e.center = ?
-    """
-
-    return helpers.fetchall_query(query, params)
+def flu_season_frame(season_year):
+    """Pulls the influenza records of a flu season in one query.
 
+    The frame has every member enrolled during the season and the records
+    classify_frame looks at for the season, its quarters or its months,
+    so the Q4, Q1 and season reports all use the same frame. It is kept
+    in memory until the database changes, so stages of one run share it
+    even without the query cache.
 
-def refused_during(params, center):
+    Args:
+        season_year: year the flu season ends in.
 
-    params = list(params) + list(params) + [center]
-
-    query = """
-    SELECT DISTINCT(e.member_id)
-    FROM enrollment e
-    LEFT JOIN influ v on e.member_id = v.member_id
-    WHERE (disenrollment_date >=?
-    OR disenrollment_date IS NULL)
-    AND enrollment_date <= ?
-    AND dose_status = 0
-    AND date_administered BETWEEN ? AND date(?, '+1 day')
-    AND e.center = ?
+    Returns:
+        pandas DataFrame from vaccination_frame, shared between callers
+        and not to be changed in place.
     """
+    return season_frame(
+        int(season_year), filepath.db_filepath, query_cache.db_version()
+    )
 
-    return helpers.fetchall_query(query, params)
-
-
-def refused_prior(params, center):
-
-    params = list(params) + [params[0], params[0]] + [center]
-
-    query = """
-    SELECT DISTINCT(e.member_id)
-    FROM enrollment e
-    LEFT JOIN influ v on e.member_id = v.member_id
-    WHERE (disenrollment_date >=?
-    OR disenrollment_date IS NULL)
-    AND enrollment_date <= ?
-    AND dose_status = 0
-    AND date_administered date(?, '-2 months') AND ?
-    AND e.center = ?
-    """
 
-    return helpers.fetchall_query(query, params)
+@functools.lru_cache(maxsize=2)
+def season_frame(season_year, db_filepath, version):
+    """Queries flu_season_frame, cached on the database and its version."""
+    params = flu_season_dates(season_year)
 
+    return vaccination_frame("influ", params, window=vaccination_window(params, 2))
 
-def contra(params, center):
 
-    params = list(params) + [center]
+def flu_season_periods(season_year):
+    """Lists the periods of a flu season: the season, its quarters and months.
 
-    query = """
-    SELECT DISTINCT(e.member_id)
-    FROM enrollment e
-    LEFT JOIN influ v on e.member_id = v.member_id
-    WHERE (disenrollment_date >=?
-    OR disenrollment_date IS NULL)
-    AND enrollment_date <= ?
-    AND dose_status = 99
-    AND e.center = ?
+    Returns:
+        dict of period name (season, {year}Q{quarter} or {year}-{month})
+        to tuple of start and end date.
     """
+    helpers = get_helpers()
+    start, end = flu_season_dates(season_year)
 
-    return helpers.fetchall_query(query, params)
-
-
-def center_influ_data(center, params, quarter, year):
-
-    eligible_ppts = [val[0] for val in eligible(params, center)]
-    during_ppts = [val[0] for val in during(params, center)]
-
-    prior_vaccs = [val[0] for val in prior(params, center)]
-    prior_ppts = [mem_id for mem_id in prior_vaccs if mem_id not in during_ppts]
+    periods = {
+        "season": (start, end),
+        f"{season_year - 1}Q4": helpers.get_quarter_dates(4, season_year - 1),
+        f"{season_year}Q1": helpers.get_quarter_dates(1, season_year),
+    }
+    for month in range(6):
+        month_start = shift_date(start, month)
+        periods[month_start[:7]] = (month_start, shift_date(month_start, 1, -1))
 
-    contra_ppts = [val[0] for val in contra(params, center)]
+    return periods
 
-    all_recieved_or_alergic = prior_ppts + during_ppts + contra_ppts
 
-    refused_vacc = [val[0] for val in refused_during(params, center)]
-    refused_ppts = [
-        mem_id for mem_id in refused_vacc if mem_id not in all_recieved_or_alergic
-    ]
+def flu_season_views(season_year, vaccinations=None):
+    """Classifies members for every period of a flu season.
 
-    all_in_influ = all_recieved_or_alergic + refused_ppts
+    Every period is classified from one flu_season_frame, so the influ
+    table is read once for the season, its quarters and its months.
 
-    missed = [mem_id for mem_id in eligible_ppts if mem_id not in all_in_influ]
+    Args:
+        season_year: year the flu season ends in.
+        vaccinations: flu_season_frame of the season, queried if None.
 
-    csvfile = f"{filepath}\\{year}Q{quarter}\\missed_vacc\\missed_influ.csv"
+    Returns:
+        dict of period name to dict of center to center_buckets.
+    """
+    periods = flu_season_periods(season_year)
+    centers = report_centers(periods["season"])
 
-    # Assuming res is a flat list
-    with open(csvfile, "a") as output:
-        writer = csv.writer(output, lineterminator="\n")
-        for val in missed:
-            writer.writerow([val])
+    if vaccinations is None:
+        vaccinations = flu_season_frame(season_year)
 
-    if len(missed) != (len(eligible_ppts) - len(all_in_influ)):
-        raise ValueError("Missed does not match eligible - all recieved or refused")
+    return {
+        period: classify_frame(vaccinations, params, centers, prior_months=2)
+        for period, params in periods.items()
+    }
 
-    return [
-        len(eligible_ppts),
-        len(during_ppts),
-        len(prior_ppts),
-        len(refused_ppts),
-        len(contra_ppts),
-        len(missed),
-    ]
 
+def flu_season_report(quarter=None, year=None):
+    """Writes the influenza counts of a whole flu season.
 
-def missed_list_for_nursing(quarter, year):
+    Counts the members in each bucket for the season, its quarters and
+    its months, for every center, to hpms_influ_season_{year}.csv in the
+    folder of the season's Q1.
 
-    df = pd.read_csv(
-        f"{filepath}\\{year}Q{quarter}\\missed_vacc\\missed_influ.csv",
-        header=None,
-        names=["member_id"],
+    Args:
+        quarter: quarter in the flu season, defaults to the last quarter.
+        year: year of the quarter.
+    """
+    if quarter is None:
+        quarter, year = get_helpers().last_quarter(return_q=True)
+
+    season_year = flu_season_year(quarter, year)
+
+    df = pd.concat(
+        {
+            period: pd.DataFrame(
+                {
+                    center: bucket_counts(buckets)
+                    for center, buckets in center_buckets.items()
+                },
+                index=influ_rows,
+            )
+            for period, center_buckets in flu_season_views(season_year).items()
+        },
+        names=["period", "bucket"],
     )
-    missed = df["member_id"].to_list()
-    member_list = ",".join(["?"] * len(missed))
 
-    q = f"""SELECT e.member_id, p.first, p.last, e.enrollment_date, e.disenrollment_date
-    FROM enrollment e
-    JOIN ppts p on e.member_id=p.member_id
-    WHERE e.member_id IN ({member_list});"""
+    path = f"{filepath.filepath}\\{season_year}Q1\\hpms_influ_season_{season_year}.csv"
+    with profiler.span("write", path, rows=len(df)):
+        df.to_csv(path)
 
-    os.remove(f"{filepath}\\{year}Q{quarter}\\missed_vacc\\missed_influ.csv")
+    return "Flu Season Complete!"
 
-    helpers.dataframe_query(q, missed).to_csv(
-        f"{filepath}\\{year}Q{quarter}\\missed_vacc\\missed_influ_hpms.csv", index=False
-    )
 
-
-def influ_vacc(quarter=None, year=None):
+def influ_vacc(quarter=None, year=None, vaccinations=None):
     """
     Gets flu season or quarter dates, calculates number of ppts in each vaccination status
     for each center during the quarter.
     
     Returns dataframe where each row is a vaccination status and each column
     is a center.    
+
+    vaccinations can be a vaccination_frame covering a longer period
+    (i.e. when backfilling several quarters), otherwise the records of
+    the whole flu season are queried for Q4 and Q1, see flu_season_frame.
     """
+    helpers = get_helpers()
 
     if quarter is not None:
         params = helpers.get_quarter_dates(quarter, year)
@@ -206,18 +182,52 @@ def influ_vacc(quarter=None, year=None):
         quarter = 1
         year = datetime.datetime.now().year
 
-    immunization_dict = {}
-    for center in ["Providence", "Woonsocket", "Westerly"]:
-        immunization_dict[center] = center_influ_data(center, params, quarter, year)
+    centers = report_centers(params)
+
+    if status_store.enabled and vaccinations is None:
+        center_buckets = stored_buckets(
+            "influ",
+            params,
+            centers,
+            prior_months=2,
+            window=vaccination_window(params, 2),
+            buckets=["missed"],
+        )
+        df = stored_counts("influ", params, centers)
+    else:
+        if vaccinations is None and int(quarter) in (4, 1):
+            vaccinations = flu_season_frame(flu_season_year(quarter, year))
+        elif vaccinations is None:
+            vaccinations = vaccination_frame(
+                "influ", params, window=vaccination_window(params, 2)
+            )
+
+        center_buckets = classify_frame(vaccinations, params, centers, prior_months=2)
+
+        immunization_dict = {}
+        for center in centers:
+            immunization_dict[center] = bucket_counts(center_buckets[center])
+
+        df = pd.DataFrame.from_dict(immunization_dict)
 
-    df_index = ["eligible", "vacc_during", "vacc_prior", "refused", "contra", "missed"]
+    df.index = influ_rows
 
-    df = pd.DataFrame.from_dict(immunization_dict)
-    df.index = df_index
+    path = f"{filepath.filepath}\\{year}Q{quarter}\\hpms_influ_Q{quarter}_{year}.csv"
+    with profiler.span("write", path, rows=len(df)):
+        df.to_csv(path)
 
-    df.to_csv(f"{filepath}\\{year}Q{quarter}\\hpms_influ_Q{quarter}_{year}.csv")
+    history_store.write_counts("influ", df, quarter, year)
 
-    missed_list_for_nursing(quarter, year)
+    missed_lists = {
+        "missed_influ_hpms": np.concatenate(
+            [center_buckets[center]["missed"] for center in centers]
+        )
+    }
+
+    if status_store.enabled and vaccinations is None:
+        stored_missed_lists("influ", params, missed_lists, quarter, year)
+    else:
+        missed_list_for_nursing(missed_lists, quarter, year)
 
     return "Influenza Complete!"
 
@@ -228,7 +238,33 @@ if __name__ == "__main__":
     parser.add_argument("--quarter", default=None, help="Number of quarter")
     parser.add_argument("--year", default=None, help="Year of quarter")
 
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time queries and file writes and write a trace file",
+    )
+    parser.add_argument(
+        "--season",
+        action="store_true",
+        help="Write the counts of the flu season the quarter is in",
+    )
+
     arguments = parser.parse_args()
 
-    create_dir_if_needed(**vars(arguments))
-    influ_vacc(**vars(arguments))
+    profiler.enabled = arguments.profile
+
+    create_dir_if_needed(arguments.quarter, arguments.year)
+    if arguments.season:
+        quarter, year = arguments.quarter, arguments.year
+        if quarter is None:
+            quarter, year = get_helpers().last_quarter(return_q=True)
+        create_dir_if_needed(1, flu_season_year(quarter, year))
+
+        with profiler.span("stage", "flu_season_report"):
+            flu_season_report(quarter, year)
+    else:
+        with profiler.span("stage", "influ_vacc"):
+            influ_vacc(arguments.quarter, arguments.year)
+
+    if arguments.profile:
+        profiler.report()
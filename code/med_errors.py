@@ -1,8 +1,18 @@
-from paceutils import Helpers
-from filepath import filepath, create_dir_if_needed, db_filepath
+from database import get_helpers, dataframe_query, dataframe_chunks
+import filepath
+from filepath import create_dir_if_needed
 import pandas as pd
 import numpy as np
 import argparse
+import csv
+import os
+import profiler
+import history_store
+from sites import site_name, site_file_suffix, registered_site_names, report_centers
+from periods import dates_between, shift_date
+
+# number of incidents read, mapped and written at a time
+incident_chunk_size = 10000
 
 
 def rename_columns(quarter_incidents, return_maps=False):
@@ -79,6 +89,46 @@ def rename_columns(quarter_incidents, return_maps=False):
     return quarter_incidents.rename(columns=rename_cols)
 
 
+def incident_columns():
+    """Lists the med_errors columns the HPMS files are made from."""
+    flag_cols = [
+        col for col_map in rename_columns(None, return_maps=True) for col in col_map
+    ]
+
+    return ["member_id", "date_discovered", "location", "comments"] + flag_cols
+
+
+incidents_query = f"""
+        SELECT {", ".join("med_errors." + col for col in incident_columns())},
+        c.center FROM med_errors
+        JOIN enrollment e on med_errors.member_id=e.member_id
+        JOIN centers c on e.member_id = c.member_id
+        WHERE date_discovered BETWEEN ? and date(?, '+1 day')
+        AND (order_written_correctly = 1
+        OR order_written_correctly='Unknown')
+        """
+
+
+def join_tags(quarter_incidents, tag_cols):
+    """Joins the names of the flagged tag columns of each incident.
+
+    The 0/1 flag columns are treated as a boolean matrix and multiplied
+    by the vector of column names, so every incident's tags are built in
+    one operation instead of cell by cell.
+
+    Args:
+        quarter_incidents: pandas DataFrame of medical incidents
+        filtered for quarter.
+        tag_cols: list of flag columns, named by their HPMS value.
+
+    Returns:
+        pandas Series of the flagged column names joined by ", ".
+    """
+    flags = quarter_incidents[tag_cols].eq(1)
+
+    return flags.dot(pd.Index(tag_cols) + ", ").str[:-2]
+
+
 def create_tag_cols(quarter_incidents):
     """Collects factors/measures into binned columns.
 
@@ -93,44 +143,40 @@ def create_tag_cols(quarter_incidents):
     contributing_map, med_error_map, measures_map = rename_columns(
         quarter_incidents, return_maps=True
     )
-    quarter_incidents["med_error_tags"] = ""
-
-    for col_name in list(med_error_map.values()):
-        indicies = quarter_incidents.loc[
-            quarter_incidents[col_name] == 1
-        ].index.tolist()
-        for i in indicies:
-            quarter_incidents.at[i, "med_error_tags"] += col_name
-
-    quarter_incidents["measures_tags"] = ""
-
-    for col_name in list(measures_map.values()):
-        indicies = quarter_incidents.loc[
-            quarter_incidents[col_name] == 1
-        ].index.tolist()
-        for i in indicies:
-            if quarter_incidents.at[i, "measures_tags"] == "":
-                quarter_incidents.at[i, "measures_tags"] += col_name
-            else:
-                addional_tags = ", " + col_name
-                quarter_incidents.at[i, "measures_tags"] += addional_tags
-
-    quarter_incidents["contributing_tags"] = ""
-
-    for col_name in list(contributing_map.values()):
-        indicies = quarter_incidents.loc[
-            quarter_incidents[col_name] == 1
-        ].index.tolist()
-        for i in indicies:
-            if quarter_incidents.at[i, "contributing_tags"] == "":
-                quarter_incidents.at[i, "contributing_tags"] += col_name
-            else:
-                addional_tags = ", " + col_name
-                quarter_incidents.at[i, "contributing_tags"] += addional_tags
+
+    quarter_incidents["med_error_tags"] = join_tags(
+        quarter_incidents, list(med_error_map.values())
+    )
+    quarter_incidents["measures_tags"] = join_tags(
+        quarter_incidents, list(measures_map.values())
+    )
+    quarter_incidents["contributing_tags"] = join_tags(
+        quarter_incidents, list(contributing_map.values())
+    )
 
     return quarter_incidents
 
 
+def map_categories(column, category_map):
+    """Maps a column to HPMS language at the category level.
+
+    Each distinct value is looked up once instead of once per row,
+    values missing from category_map raise a KeyError.
+
+    Args:
+        column: pandas Series, converted to a categorical if needed.
+        category_map: dict of value to HPMS value.
+
+    Returns:
+        categorical pandas Series of HPMS values.
+    """
+    categories = column.astype("category").cat.remove_unused_categories()
+
+    return categories.cat.rename_categories(
+        [category_map[category] for category in categories.cat.categories]
+    )
+
+
 def map_location_and_center(quarter_incidents):
     """Maps location and centers coloumns to HPMS language.
 
@@ -152,18 +198,15 @@ def map_location_and_center(quarter_incidents):
         "Nursing Home": "Nursing Facility",
     }
 
-    quarter_incidents["location"] = quarter_incidents["location"].map(
-        lambda x: location_map[x]
+    quarter_incidents["location"] = map_categories(
+        quarter_incidents["location"], location_map
     )
 
-    center_map = {
-        "Providence": "PACE Rhode Island - Providence",
-        "Woonsocket": "PACE Rhode Island - Woonsocket",
-        "Westerly": "PACE Rhode Island - Westerly",
-    }
+    centers = quarter_incidents["center"].astype("category").cat.categories
+    center_map = {center: site_name(center) for center in centers}
 
-    quarter_incidents["center"] = quarter_incidents["center"].map(
-        lambda x: center_map[x]
+    quarter_incidents["center"] = map_categories(
+        quarter_incidents["center"], center_map
     )
 
     return quarter_incidents
@@ -193,7 +236,7 @@ def create_csv(quarter_incidents):
 
     quarter_incidents.rename(columns=final_cols_map, inplace=True)
     quarter_incidents["Indicator Type - v1"] = "IB"
-    quarter_incidents["Contract Number"] = "H4105"
+    quarter_incidents["Contract Number"] = filepath.contract
 
     # fillna cols correctly
 
@@ -239,93 +282,196 @@ def create_csv(quarter_incidents):
     return final_med_incidents
 
 
-def med_errors(quarter=None, year=None):
-    helpers = Helpers(db_filepath)
+def write_site_files(frames, quarter, year, site_names=None):
+    """Writes the tab delimited HPMS upload file of every site.
 
-    if quarter is None:
-        params = helpers.last_quarter()
-        quarter, year = helpers.last_quarter(return_q=True)
-    else:
-        params = helpers.get_quarter_dates(quarter, year)
+    Rows are partitioned by Site Name as they are read, so the incidents
+    are only scanned once however many sites there are. Each file starts
+    with the IB v2.0 header row followed by the column names. Sites in
+    site_names get a file even if they had no incidents.
 
-    query = """
-        SELECT med_errors.*, c.center FROM med_errors
-        JOIN enrollment e on med_errors.member_id=e.member_id
-        JOIN centers c on e.member_id = c.member_id
-        WHERE date_discovered BETWEEN ? and date(?, '+1 day')
-        AND (order_written_correctly = 1
-        OR order_written_correctly='Unknown')
-        """
+    Args:
+        frames: iterable of pandas DataFrames of upload rows, each with
+        a Site Name column.
+        quarter: quarter number.
+        year: year of the quarter.
+        site_names: HPMS site names that always get a file, defaults to
+        the sites in site_registry.
+    """
+    if site_names is None:
+        site_names = registered_site_names()
 
-    quarter_incidents = rename_columns(helpers.dataframe_query(query, params))
-    quarter_incidents = create_tag_cols(quarter_incidents)
-    quarter_incidents = map_location_and_center(quarter_incidents)
+    tab_cols = ["IB v2.0"] + [""] * 8
+    uploads = {}
+
+    def upload_file(site, columns):
+        if site not in uploads:
+            suffix = site_file_suffix(site)
+            file_name = f"hpms_med_errors_Q{quarter}_{year}_{suffix}.txt"
+            upload = open(
+                f"{filepath.filepath}\\{year}Q{quarter}\\{file_name}", "w", newline=""
+            )
+            writer = csv.writer(upload, delimiter="\t", lineterminator=os.linesep)
+            writer.writerow(tab_cols)
+            writer.writerow(columns)
+            uploads[site] = upload
+
+        return uploads[site]
+
+    try:
+        columns = None
+        for frame in frames:
+            columns = list(frame.columns)
+            sites = frame.groupby("Site Name", sort=False, observed=True).indices
+            for site, rows in sites.items():
+                upload = upload_file(site, columns)
+                with profiler.span("write", upload.name, rows=len(rows)):
+                    frame.iloc[rows].to_csv(
+                        upload, sep="\t", index=False, header=False
+                    )
+
+        if columns is not None:
+            for site in site_names:
+                upload_file(site, columns)
+    finally:
+        for upload in uploads.values():
+            upload.close()
+
+
+def incidents_frame(params):
+    """Pulls the med error incidents discovered during the period.
 
-    final_df = create_csv(quarter_incidents)
+    Args:
+        params: tuple of start and end date of the period.
 
-    other_contr_filter = (
-        final_df["Contributing Factors (use values from separate worksheet)"]
-        != "Other - Provide Additional Details"
-    )
-    final_df["Other Contributing Factor"] = np.where(
-        other_contr_filter, "", final_df["Other Contributing Factor"]
-    )
+    Returns:
+        pandas DataFrame of med error incidents with the member's center.
+    """
+    return compact_incidents(dataframe_query(incidents_query, params))
 
-    other_action_filter = (
-        final_df["Actions Taken (use values from separate worksheet)"]
-        != "Other - Provide Additional Details"
-    )
-    final_df["Other Action"] = np.where(
-        other_action_filter, "", final_df["Other Action"]
-    )
 
-    final_df.to_csv(
-        f"{filepath}\\{year}Q{quarter}\\hpms_med_errors_Q{quarter}_{year}.csv",
-        index=False,
-    )
-    final_df.drop(["Member ID"], axis=1, inplace=True)
+def compact_incidents(incidents):
+    """Shrinks the incident DataFrame before it is sliced and tagged.
+
+    The 0/1 factor flags are stored as uint8 instead of int64 and the
+    repeated location and center strings as categoricals.
+    other_contributing_factor holds the free text written to the Other
+    Contributing Factor column and is left as it is.
+
+    Args:
+        incidents: pandas DataFrame of med error incidents.
 
-    final_df = final_df[
-        final_df["Type of Medication Error (select from dropdown)"] != ""
+    Returns:
+        incidents with compact column dtypes.
+    """
+    flag_cols = [
+        col
+        for col_map in rename_columns(None, return_maps=True)
+        for col in col_map
+        if col != "other_contributing_factor"
     ]
+    incidents[flag_cols] = incidents[flag_cols].fillna(0).astype("uint8")
 
-    final_pvd = final_df[
-        final_df["Site Name"] == "PACE Rhode Island - Providence"
-    ].copy()
-    final_woo = final_df[
-        final_df["Site Name"] == "PACE Rhode Island - Woonsocket"
-    ].copy()
-    final_wes = final_df[final_df["Site Name"] == "PACE Rhode Island - Westerly"].copy()
+    for col in ["location", "center"]:
+        incidents[col] = incidents[col].astype("category")
 
-    tab_cols = ["IB v2.0"] + [""] * 8
+    return incidents
 
-    first_row = pd.DataFrame(
-        data=[final_df.columns], index=[0], columns=final_df.columns
-    )
 
-    final_pvd = first_row.append(final_pvd, sort=False)
-    final_woo = first_row.append(final_woo, sort=False)
-    final_wes = first_row.append(final_wes, sort=False)
+def incident_chunks(params):
+    """Streams the med error incidents discovered during the period.
 
-    final_pvd.columns = tab_cols
-    final_woo.columns = tab_cols
-    final_wes.columns = tab_cols
+    Yields:
+        compact_incidents DataFrames of up to incident_chunk_size incidents.
+    """
+    for chunk in dataframe_chunks(incidents_query, params, incident_chunk_size):
+        yield compact_incidents(chunk)
 
-    final_pvd.to_csv(
-        f"{filepath}\\{year}Q{quarter}\\hpms_med_errors_Q{quarter}_{year}_pvd.txt",
-        index=False,
-        sep="\t",
-    )
-    final_woo.to_csv(
-        f"{filepath}\\{year}Q{quarter}\\hpms_med_errors_Q{quarter}_{year}_woon.txt",
-        index=False,
-        sep="\t",
-    )
-    final_wes.to_csv(
-        f"{filepath}\\{year}Q{quarter}\\hpms_med_errors_Q{quarter}_{year}_wes.txt",
-        index=False,
-        sep="\t",
-    )
+
+def upload_frames(chunks, params, path, write_history):
+    """Maps chunks of incidents to HPMS rows, writing the full CSV as it goes.
+
+    Each chunk is renamed, tagged and mapped on its own, so only one
+    chunk of incidents is in memory at a time.
+
+    Args:
+        chunks: iterable of compact_incidents DataFrames, may cover
+        more than the period.
+        params: tuple of start and end date of the period.
+        path: path of the CSV of every incident, with member ids.
+        write_history: history_store.partition_writer function the rows
+        of the CSV are also written to.
+
+    Yields:
+        pandas DataFrames of the rows of the HPMS upload files.
+    """
+    header = True
+    for incidents in chunks:
+        discovered = dates_between(
+            incidents["date_discovered"], params[0], shift_date(params[1], days=1)
+        )
+
+        quarter_incidents = rename_columns(incidents.loc[discovered].copy())
+        quarter_incidents = create_tag_cols(quarter_incidents)
+        quarter_incidents = map_location_and_center(quarter_incidents)
+
+        final_df = create_csv(quarter_incidents)
+
+        other_contr_filter = (
+            final_df["Contributing Factors (use values from separate worksheet)"]
+            != "Other - Provide Additional Details"
+        )
+        final_df["Other Contributing Factor"] = np.where(
+            other_contr_filter, "", final_df["Other Contributing Factor"]
+        )
+
+        other_action_filter = (
+            final_df["Actions Taken (use values from separate worksheet)"]
+            != "Other - Provide Additional Details"
+        )
+        final_df["Other Action"] = np.where(
+            other_action_filter, "", final_df["Other Action"]
+        )
+
+        with profiler.span("write", path, rows=len(final_df)):
+            final_df.to_csv(
+                path, mode="w" if header else "a", header=header, index=False
+            )
+        header = False
+
+        write_history(final_df)
+
+        final_df.drop(["Member ID"], axis=1, inplace=True)
+
+        yield final_df[
+            final_df["Type of Medication Error (select from dropdown)"] != ""
+        ]
+
+
+def med_errors(quarter=None, year=None, incidents=None):
+    helpers = get_helpers()
+
+    if quarter is None:
+        params = helpers.last_quarter()
+        quarter, year = helpers.last_quarter(return_q=True)
+    else:
+        params = helpers.get_quarter_dates(quarter, year)
+
+    if incidents is None:
+        chunks = incident_chunks(params)
+    else:
+        chunks = [incidents]
+
+    path = f"{filepath.filepath}\\{year}Q{quarter}\\hpms_med_errors_Q{quarter}_{year}.csv"
+    site_names = [site_name(center) for center in report_centers(params)]
+
+    with history_store.partition_writer("med_errors", quarter, year) as write_history:
+        write_site_files(
+            upload_frames(chunks, params, path, write_history),
+            quarter,
+            year,
+            site_names,
+        )
 
     return "Med Errors Complete!"
 
@@ -336,7 +482,19 @@ if __name__ == "__main__":
     parser.add_argument("--quarter", default=None, help="Number of quarter")
     parser.add_argument("--year", default=None, help="Year of quarter")
 
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time queries and file writes and write a trace file",
+    )
+
     arguments = parser.parse_args()
 
-    create_dir_if_needed(**vars(arguments))
-    med_errors(**vars(arguments))
+    profiler.enabled = arguments.profile
+
+    create_dir_if_needed(arguments.quarter, arguments.year)
+    with profiler.span("stage", "med_errors"):
+        med_errors(arguments.quarter, arguments.year)
+
+    if arguments.profile:
+        profiler.report()
@@ -0,0 +1,147 @@
+import datetime
+import math
+
+
+def shift_date(date, months=0, days=0):
+    """Shifts a date the same way SQLite's date(?, '+N months', '+N days') does.
+
+    Args:
+        date: ISO formatted date string (or date) to shift.
+        months: number of months to add, may be negative.
+        days: number of days to add, may be negative.
+
+    Returns:
+        ISO formatted date string.
+    """
+    date = datetime.date(*map(int, str(date)[:10].split("-")))
+    month_index = date.year * 12 + date.month - 1 + months
+
+    shifted = datetime.date(month_index // 12, month_index % 12 + 1, 1)
+    shifted += datetime.timedelta(days=date.day - 1 + days)
+
+    return shifted.isoformat()
+
+
+def age_cutoff(date, min_age):
+    """Returns the earliest birth date of members under min_age on date.
+
+    Members born before the cutoff are at least min_age years old by the
+    (julianday(date) - julianday(dob)) / 365.25 definition of age, so
+    eligibility is a plain range on dob.
+
+    Args:
+        date: ISO formatted date string (or date) age is measured on.
+        min_age: age in years, may be fractional.
+
+    Returns:
+        ISO formatted date string.
+    """
+    return shift_date(date, days=1 - math.ceil(min_age * 365.25))
+
+
+def parse_quarter(quarter_str):
+    """Parses a quarter written as {year}Q{quarter}, i.e. 2019Q3.
+
+    Returns:
+        tuple of quarter and year as ints.
+    """
+    year, quarter = quarter_str.upper().split("Q")
+    quarter, year = int(quarter), int(year)
+
+    if quarter not in (1, 2, 3, 4):
+        raise ValueError(f"{quarter_str} is not a valid quarter")
+
+    return quarter, year
+
+
+def date_quarter(date):
+    """Returns the quarter a date falls in.
+
+    Returns:
+        tuple of quarter and year as ints.
+    """
+    year, month = map(int, str(date)[:10].split("-")[:2])
+
+    return (month - 1) // 3 + 1, year
+
+
+def quarters_between(start, end):
+    """Lists every quarter from start to end, inclusive.
+
+    Args:
+        start: tuple of quarter and year of the first quarter.
+        end: tuple of quarter and year of the last quarter.
+
+    Returns:
+        list of (quarter, year) tuples in order.
+    """
+    first = start[1] * 4 + start[0] - 1
+    last = end[1] * 4 + end[0] - 1
+
+    if last < first:
+        raise ValueError("End quarter is before start quarter")
+
+    return [(index % 4 + 1, index // 4) for index in range(first, last + 1)]
+
+
+def dates_between(dates, start, end):
+    """Flags ISO date strings that fall between start and end, inclusive.
+
+    Matches SQLite's text comparison of dates, missing dates are never
+    between.
+
+    Args:
+        dates: pandas Series of ISO formatted date strings.
+        start: first date of the range.
+        end: last date of the range.
+
+    Returns:
+        boolean pandas Series.
+    """
+    filled = dates.fillna("")
+    return dates.notna() & (filled >= str(start)) & (filled <= str(end))
+
+
+def enrolled_filter(table="enrollment"):
+    """Returns the SQL filter of enrollment records that overlap the period.
+
+    The SQL form of enrolled_during, taking the start and end date of the
+    period as parameters. Every record enrolled before the end date is in
+    range of an enrollment_date index, so the unary + keeps SQLite from
+    reading the records off it and the disenrollment_date index only reads
+    the records of members still enrolled at the start.
+
+    Args:
+        table: name or alias of the enrollment table in the query.
+
+    Returns:
+        SQL string.
+    """
+    return f"""({table}.disenrollment_date >= ?
+    OR {table}.disenrollment_date IS NULL)
+    AND +{table}.enrollment_date <= ?"""
+
+
+def enrolled_during(enrollments, params):
+    """Flags enrollment records that overlap the period.
+
+    Matches the enrolled_filter of the report queries.
+
+    Args:
+        enrollments: pandas DataFrame with enrollment_date and
+        disenrollment_date columns.
+        params: tuple of start and end date of the period.
+
+    Returns:
+        boolean pandas Series.
+    """
+    start, end = str(params[0]), str(params[1])
+
+    enrollment_date = enrollments["enrollment_date"]
+    disenrollment_date = enrollments["disenrollment_date"]
+
+    return (
+        enrollment_date.notna()
+        & (enrollment_date.fillna("") <= end)
+        & (disenrollment_date.isna() | (disenrollment_date.fillna("") >= start))
+    )
@@ -0,0 +1,281 @@
+import asyncio
+import importlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+import profiler
+from filepath import create_dir_if_needed
+
+# times a stage is run again when the database is locked by a writer,
+# waiting lock_retry_seconds, then twice as long after each attempt
+lock_retries = 3
+lock_retry_seconds = 1.0
+
+# report stages by name, see register_stage
+stage_registry = {}
+
+
+def register_stage(
+    name, function, depends=(), quarters=(1, 2, 3, 4), preload=None, tables=None
+):
+    """Adds a stage to the stages run for every quarter.
+
+    Adding an HPMS report is registering the function that writes it,
+    i.e. register_stage("falls", "falls:hpms_falls", depends=["output_folders"]).
+
+    Args:
+        name: name of the stage in the summary.
+        function: function called with quarter and year keyword arguments,
+        or a "module:function" string imported when the stage runs.
+        depends: names of the stages that have to finish first.
+        quarters: quarters the stage runs for.
+        preload: tuple of the keyword argument and the key of the
+        preloaded records passed to the function, i.e.
+        ("vaccinations", "pneumo").
+        tables: database tables the stage reads, the stage is run again
+        by watch.py when one of them changes. None for any change.
+    """
+    stage_registry[name] = {
+        "function": function,
+        "depends": list(depends),
+        "quarters": tuple(quarters),
+        "preload": preload,
+        "tables": None if tables is None else list(tables),
+    }
+
+
+def output_folders(quarter, year):
+    """Creates the quarter's output folders before the reports write to them."""
+    create_dir_if_needed(quarter, year)
+
+    return "Folders Ready!"
+
+
+register_stage("output_folders", output_folders, tables=[])
+register_stage(
+    "hpms_enrollment",
+    "enrollment:hpms_enrollment",
+    depends=["output_folders"],
+    preload=("enrollments", "enrollments"),
+    tables=["enrollment"],
+)
+register_stage(
+    "med_errors",
+    "med_errors:med_errors",
+    depends=["output_folders"],
+    preload=("incidents", "incidents"),
+    tables=["med_errors", "enrollment", "centers"],
+)
+register_stage(
+    "pneumo_vacc",
+    "pneumo:pneumo_vacc",
+    depends=["output_folders"],
+    preload=("vaccinations", "pneumo"),
+    tables=["enrollment", "demographics", "pneumo", "ppts"],
+)
+register_stage(
+    "influ_vacc",
+    "influenza:influ_vacc",
+    depends=["output_folders"],
+    quarters=(4, 1),
+    preload=("vaccinations", "influ"),
+    tables=["enrollment", "demographics", "influ", "ppts"],
+)
+register_stage(
+    "flu_season_report",
+    "influenza:flu_season_report",
+    depends=["influ_vacc"],
+    quarters=(1,),
+    tables=["enrollment", "demographics", "influ"],
+)
+
+
+def stage_function(function):
+    """Imports a "module:function" stage function, other functions are returned.
+
+    Stage modules pull in pandas and paceutils, so they are only
+    imported to run.
+    """
+    if not isinstance(function, str):
+        return function
+
+    module, name = function.split(":")
+
+    return getattr(importlib.import_module(module), name)
+
+
+def report_stages(q, yr, preloaded=None, prefix=""):
+    """Lists the registered stages to run for the quarter.
+
+    Args:
+        q: quarter to run.
+        yr: year of the quarter.
+        preloaded: dict of records covering the quarter, keyed by the
+        preload keys of the registry (enrollments, incidents, pneumo and
+        influ), missing records are queried by the stages.
+        prefix: added to the name of every stage and dependency, to run
+        the stages of several quarters together.
+
+    Returns:
+        list of (name, function, kwargs, depends) tuples.
+    """
+    preloaded = preloaded or {}
+
+    stages = []
+    for name, stage in stage_registry.items():
+        if int(q) not in stage["quarters"]:
+            continue
+
+        kwargs = {"quarter": q, "year": yr}
+        if stage["preload"] is not None:
+            argument, key = stage["preload"]
+            kwargs[argument] = preloaded.get(key)
+
+        stages.append(
+            (
+                prefix + name,
+                stage["function"],
+                kwargs,
+                [prefix + dependency for dependency in stage["depends"]],
+            )
+        )
+
+    return stages
+
+
+def stage_subset(stages, names):
+    """Keeps the named stages, dropping dependencies on the other stages.
+
+    Used to run some stages again once their dependencies have run.
+    """
+    return [
+        (name, function, kwargs, [dep for dep in depends if dep in names])
+        for name, function, kwargs, depends in stages
+        if name in names
+    ]
+
+
+def stage_order(stages):
+    """Checks every dependency is a stage and the stages have no cycle.
+
+    Returns:
+        list of stage names, each after its dependencies.
+    """
+    depends = {stage[0]: stage[3] for stage in stages}
+
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Stage {name} is part of a dependency cycle")
+
+        visiting.add(name)
+        for dependency in depends[name]:
+            if dependency not in depends:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+            visit(dependency)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in depends:
+        visit(name)
+
+    return order
+
+
+def database_locked(error):
+    """Checks if an error is SQLite giving up on a locked database.
+
+    pandas wraps the sqlite3 errors of read_sql_query in its own
+    DatabaseError, so the errors it was raised from are checked too.
+    """
+    while isinstance(error, BaseException):
+        if isinstance(error, sqlite3.OperationalError) and (
+            "database is locked" in str(error)
+        ):
+            return True
+        error = error.__cause__ or error.__context__
+
+    return False
+
+
+async def run_graph(stages, jobs, executor=None):
+    """Runs the stages on an event loop as soon as their dependencies finish.
+
+    Stage functions run on a pool of jobs threads, so one stage's file
+    writes overlap the next stage's queries. A stage whose dependency
+    failed is not run and fails too. An executor passed in is left
+    running, its threads keep their database connections.
+    """
+    stage_order(stages)
+
+    loop = asyncio.get_running_loop()
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    tasks = {}
+
+    def timed(name, function, kwargs):
+        start = time.perf_counter()
+        try:
+            with profiler.span("stage", name):
+                result = stage_function(function)(**kwargs)
+        except Exception as error:
+            result = error
+        return time.perf_counter() - start, result
+
+    async def run(name, function, kwargs, depends):
+        for dependency in depends:
+            _, result = await tasks[dependency]
+            if isinstance(result, Exception):
+                return 0.0, RuntimeError(f"Skipped, {dependency} failed")
+
+        total = 0.0
+        for attempt in range(lock_retries + 1):
+            seconds, result = await loop.run_in_executor(
+                executor, timed, name, function, kwargs
+            )
+            total += seconds
+            if not database_locked(result) or attempt == lock_retries:
+                break
+            await asyncio.sleep(lock_retry_seconds * 2**attempt)
+
+        return total, result
+
+    try:
+        for name, function, kwargs, depends in stages:
+            tasks[name] = asyncio.ensure_future(run(name, function, kwargs, depends))
+
+        results = [await tasks[name] for name, _, _, _ in stages]
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+
+    return [(name,) + result for (name, _, _, _), result in zip(stages, results)]
+
+
+def run_stages(stages, jobs=None, executor=None):
+    """Runs report stages in dependency order on a pool of jobs threads.
+
+    A failing stage does not stop the others, its error is kept
+    for the summary instead. Stages failing on a locked database are
+    retried lock_retries times.
+
+    Args:
+        stages: list of (name, function, kwargs, depends) tuples.
+        jobs: number of stages to run at the same time, defaults to the
+        number of CPUs.
+        executor: ThreadPoolExecutor to run the stages on, reused across
+        runs, jobs is ignored if given.
+
+    Returns:
+        list of (name, seconds, result or exception) tuples in stage order.
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    return asyncio.run(run_graph(stages, max(1, min(jobs, len(stages))), executor))
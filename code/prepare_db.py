@@ -0,0 +1,340 @@
+import argparse
+import re
+import sqlite3
+import filepath
+import status_store
+from database import connect, member_batch_size
+from enrollment import (
+    enrollment_query,
+    enrollment_member_query,
+    organization_filters,
+    organization_query,
+)
+from med_errors import incidents_query
+from sites import centers_query
+from vaccination import (
+    vaccination_query,
+    vaccination_params,
+    vaccination_window,
+    member_details_query,
+)
+
+# (table, columns) of the indexes the report queries rely on, chosen
+# from their query plans. The disenrollment date index covers the period
+# filter of every enrollment query (see periods.enrolled_filter) and the
+# disenrolled rows, the enrollment date index only the enrolled rows of
+# enrollment.organization_query and the member id indexes cover the joins
+# and lookups on member_id
+report_indexes = [
+    ("enrollment", ["disenrollment_date", "enrollment_date", "center", "member_id"]),
+    ("enrollment", ["enrollment_date", "disenrollment_date", "center", "member_id"]),
+    ("enrollment", ["member_id", "enrollment_date", "disenrollment_date"]),
+    ("pneumo", ["member_id", "dose_status", "date_administered"]),
+    ("influ", ["member_id", "dose_status", "date_administered"]),
+    ("demographics", ["member_id", "dob"]),
+    ("ppts", ["member_id", "first", "last"]),
+    ("centers", ["member_id", "center"]),
+    ("med_errors", ["date_discovered"]),
+]
+
+# tables read by the reports, their changes are logged for the status
+# store, see status_store.table_mark
+change_log_tables = [
+    "enrollment",
+    "demographics",
+    "pneumo",
+    "influ",
+    "ppts",
+    "centers",
+    "med_errors",
+]
+
+
+def report_queries(change_log=True):
+    """Lists every query the reports run with representative parameters.
+
+    Args:
+        change_log: if True the status store queries of the change log
+        are included, see create_change_log.
+
+    Returns:
+        list of (name, query, params) tuples.
+    """
+    params = ["2019-01-01", "2019-03-31"]
+    window = vaccination_window(params, 2)
+    member_ids = ", ".join(["?"] * member_batch_size)
+    members = [None] * member_batch_size
+
+    queries = [
+        ("enrollment_frame", enrollment_query, params),
+        (
+            "stored_enrollment_data",
+            enrollment_member_query.format(member_ids=member_ids),
+            params + members,
+        ),
+        (
+            "organization_totals",
+            organization_query,
+            params * len(organization_filters),
+        ),
+        ("incidents_frame", incidents_query, params),
+        ("report_centers", centers_query, params),
+        (
+            "vaccination_frame pneumo",
+            vaccination_query("pneumo", 65),
+            vaccination_params(params, 65),
+        ),
+        (
+            "vaccination_frame influ",
+            vaccination_query("influ"),
+            vaccination_params(params),
+        ),
+        (
+            "flu_season_frame",
+            vaccination_query("influ", windowed=True),
+            vaccination_params(params, window=window),
+        ),
+        (
+            "stored_buckets pneumo",
+            vaccination_query("pneumo", 65, by_member=True).format(
+                member_ids=member_ids
+            ),
+            vaccination_params(params, 65) + members,
+        ),
+        (
+            "stored_buckets influ",
+            vaccination_query("influ", by_member=True, windowed=True).format(
+                member_ids=member_ids
+            ),
+            vaccination_params(params, window=window) + members,
+        ),
+        (
+            "missed_list_for_nursing",
+            member_details_query.format(member_ids=member_ids),
+            members,
+        ),
+        ("table_mark", status_store.triggers_query, ["pneumo"]),
+    ]
+
+    if change_log:
+        queries += [
+            ("table_mark change log", status_store.last_change_query, ["pneumo"]),
+            ("changed_members", status_store.changes_query, ["pneumo", 0, 1]),
+        ]
+
+    return queries
+
+
+def has_index(conn, table, columns):
+    """Checks if the table already has an index usable in place of columns.
+
+    An index starting with the same columns, in the same order, is
+    equivalent. So is an INTEGER PRIMARY KEY first column, lookups on
+    it go straight to the row.
+
+    Args:
+        conn: sqlite3 Connection.
+        table: name of the table.
+        columns: list of index columns.
+
+    Returns:
+        bool
+    """
+    table_info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    primary_keys = [row for row in table_info if row[5]]
+
+    if (
+        len(primary_keys) == 1
+        and primary_keys[0][1] == columns[0]
+        and primary_keys[0][2].upper() == "INTEGER"
+    ):
+        return True
+
+    for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        index_columns = [
+            row[2] for row in conn.execute(f"PRAGMA index_info({index[1]})")
+        ]
+        if index_columns[: len(columns)] == columns:
+            return True
+
+    return False
+
+
+def create_indexes(db_filepath=None):
+    """Creates the report_indexes missing from the database.
+
+    Uses its own writable connection, the report connections are read-only.
+
+    Args:
+        db_filepath: path to the SQLite database, defaults to the one
+        in filepath.py.
+
+    Returns:
+        list of names of the created indexes.
+    """
+    if db_filepath is None:
+        db_filepath = filepath.db_filepath
+
+    created = []
+    conn = sqlite3.connect(db_filepath)
+    try:
+        with conn:
+            for table, columns in report_indexes:
+                if has_index(conn, table, columns):
+                    continue
+
+                # named after every column, another index by the same
+                # name fails the CREATE instead of being reported as created
+                name = f"idx_{table}_{'_'.join(columns)}"
+                conn.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+                created.append(name)
+
+        if created:
+            conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+
+    return created
+
+
+def create_change_log(db_filepath=None):
+    """Creates the change log and the triggers of change_log_tables.
+
+    Every insert, update and delete on the tables logs the member it
+    changes to hpms_changes, so the status store only classifies those
+    members again. Tables missing from the database are skipped.
+
+    Args:
+        db_filepath: path to the SQLite database, defaults to the one
+        in filepath.py.
+
+    Returns:
+        list of names of the created triggers.
+    """
+    if db_filepath is None:
+        db_filepath = filepath.db_filepath
+
+    created = []
+    conn = sqlite3.connect(db_filepath)
+    try:
+        with conn:
+            conn.execute(status_store.change_log_query)
+            conn.execute(status_store.change_log_index_query)
+
+            tables = {
+                row[0]
+                for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'"
+                )
+            }
+            triggers = {
+                row[0]
+                for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+                )
+            }
+
+            for table in change_log_tables:
+                if table not in tables:
+                    continue
+
+                for name, query in status_store.change_triggers(table).items():
+                    if name not in triggers:
+                        conn.execute(query)
+                        created.append(name)
+    finally:
+        conn.close()
+
+    return created
+
+
+def unbounded_search(detail):
+    """Checks if a SEARCH plan only bounds its index range from above.
+
+    The plan lists the constraints of the range, i.e. (member_id=?) or
+    (disenrollment_date>? AND disenrollment_date<?). Without an equality
+    or a lower bound the range starts at the first index entry, so an
+    upper bound on a date reads every record back to the oldest one.
+
+    Args:
+        detail: plan detail of a SEARCH.
+
+    Returns:
+        bool
+    """
+    match = re.search(r"\((.*)\)", detail.replace("<expr>", "expr"))
+    if match is None:
+        return False
+
+    return not any("=" in term or ">" in term for term in match.group(1).split(" AND "))
+
+
+def full_scans(db_filepath=None):
+    """Runs EXPLAIN QUERY PLAN over every report query.
+
+    A SCAN of a table, even in index order, an automatic index SQLite
+    has to build for the query or a SEARCH of an unbounded range
+    (see unbounded_search) reads the whole table. Scans of subqueries
+    and of the schema are not counted.
+
+    Args:
+        db_filepath: path to the SQLite database, defaults to the one
+        in filepath.py.
+
+    Returns:
+        list of (query name, plan detail) tuples of every full scan.
+    """
+    scans = []
+    conn = connect(db_filepath)
+    try:
+        change_log = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'hpms_changes'"
+        ).fetchall()
+
+        for name, query, params in report_queries(bool(change_log)):
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params):
+                detail = row[-1]
+                words = detail.split()
+                if (
+                    (
+                        words[0] == "SCAN"
+                        and not words[1].startswith(("(", "sqlite_"))
+                        and "CONSTANT ROW" not in detail
+                    )
+                    or (words[0] == "SEARCH" and unbounded_search(detail))
+                    or "AUTOMATIC" in detail
+                ):
+                    scans.append((name, detail))
+    finally:
+        conn.close()
+
+    return scans
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--db", default=None, help="Path to the database, defaults to filepath.py"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only check the query plans, do not create indexes or the change log",
+    )
+
+    arguments = parser.parse_args()
+
+    if not arguments.check:
+        for name in create_indexes(arguments.db) + create_change_log(arguments.db):
+            print(f"Created {name}")
+
+    scans = full_scans(arguments.db)
+
+    if scans:
+        raise SystemExit(
+            "Full table scans in report queries:\n"
+            + "\n".join(f"{name:<28}{detail}" for name, detail in scans)
+        )
+
+    print("Every report query uses an index")
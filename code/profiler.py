@@ -0,0 +1,124 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import filepath
+
+# spans of report stages, SQL statements and file writes, recorded as
+# Chrome trace events (chrome://tracing or https://ui.perfetto.dev)
+enabled = False
+
+_lock = threading.Lock()
+_events = []
+_origin = time.perf_counter()
+
+
+@contextlib.contextmanager
+def span(category, name, **args):
+    """Times the code in the with block as a trace event when profiling.
+
+    Yields a dict of the event's arguments, values added to it while the
+    block runs (i.e. a row count) are recorded with the event.
+
+    Args:
+        category: type of span, i.e. stage, query or write.
+        name: name of the span in the trace and summary.
+        **args: arguments recorded with the event.
+    """
+    if not enabled:
+        yield args
+        return
+
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - _origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        with _lock:
+            _events.append(event)
+
+
+def events():
+    """Returns a copy of the recorded trace events."""
+    with _lock:
+        return list(_events)
+
+
+def clear():
+    """Drops every recorded trace event."""
+    with _lock:
+        _events.clear()
+
+
+def trace_filepath():
+    """Returns the path of the trace file, in the output folder."""
+    return f"{filepath.filepath}\\hpms_profile.json"
+
+
+def write_trace(path=None):
+    """Writes the recorded events as a Chrome trace JSON file.
+
+    Args:
+        path: path of the trace file, defaults to trace_filepath.
+
+    Returns:
+        path of the trace file.
+    """
+    if path is None:
+        path = trace_filepath()
+
+    with open(path, "w") as trace:
+        json.dump({"traceEvents": events(), "displayTimeUnit": "ms"}, trace)
+
+    return path
+
+
+def summary(top=10):
+    """Formats the slowest spans and the total time of each category.
+
+    Args:
+        top: number of slowest spans to list.
+
+    Returns:
+        summary string.
+    """
+    recorded = sorted(events(), key=lambda event: event["dur"], reverse=True)
+
+    lines = [f"Slowest {min(top, len(recorded))} of {len(recorded)} spans"]
+    for event in recorded[:top]:
+        name = event["name"] if len(event["name"]) <= 60 else event["name"][:57] + "..."
+        rows = event["args"].get("rows")
+        lines.append(
+            f"{event['cat']:<8}{event['dur'] / 1e6:>8.3f}s  {name}"
+            + ("" if rows is None else f"  ({rows} rows)")
+        )
+
+    totals = {}
+    for event in recorded:
+        seconds, count = totals.get(event["cat"], (0.0, 0))
+        totals[event["cat"]] = (seconds + event["dur"] / 1e6, count + 1)
+
+    lines.append("Total by category")
+    for category, (seconds, count) in sorted(totals.items()):
+        lines.append(f"{category:<8}{seconds:>8.3f}s  {count} spans")
+
+    return "\n".join(lines)
+
+
+def report(path=None, top=10):
+    """Writes the trace file and prints the summary, for --profile runs."""
+    path = write_trace(path)
+
+    print(summary(top))
+    print(f"Trace written to {path}")
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import filepath
+
+# results of the report queries are kept in a SQLite file in the output
+# folder, least recently used results are dropped past max_bytes
+enabled = True
+max_bytes = 512 * 1024 * 1024
+
+_lock = threading.Lock()
+_cache = None
+# last use time of results read since the last write, saved with the next
+# write so cache hits only read from the cache file
+_used = {}
+_stats = {"cache_hits": 0, "cache_misses": 0, "cache_evictions": 0}
+
+
+def cache_filepath():
+    """Returns the path of the cache file, in the output folder."""
+    return f"{filepath.filepath}\\query_cache.db"
+
+
+def db_version(db_filepath=None):
+    """Identifies the current contents of the database file.
+
+    Any write to the database changes the modified time or size of the
+    file or of its write-ahead log.
+
+    Args:
+        db_filepath: path to the SQLite database, defaults to the one
+        in filepath.py.
+
+    Returns:
+        string of modified time and size of the database and its log.
+    """
+    if db_filepath is None:
+        db_filepath = filepath.db_filepath
+
+    version = []
+    for path in [db_filepath, f"{db_filepath}-wal"]:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            version.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+
+    return "|".join(version)
+
+
+def cache_key(kind, query, params, db_filepath=None):
+    """Hashes the database, whitespace normalized query and parameters.
+
+    Args:
+        kind: type of result, results of the same query are
+        cached separately for fetchall_query and dataframe_query.
+        query: SQL query string.
+        params: query parameters.
+        db_filepath: path to the SQLite database, defaults to the one
+        in filepath.py.
+
+    Returns:
+        hex digest string.
+    """
+    if db_filepath is None:
+        db_filepath = filepath.db_filepath
+
+    payload = json.dumps(
+        [kind, str(db_filepath), " ".join(query.split()), list(params)], default=str
+    )
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _connection():
+    """Returns the cache connection, opening it if the output folder moved."""
+    global _cache
+
+    path = cache_filepath()
+
+    if _cache is None or _cache[0] != path:
+        os.makedirs(filepath.filepath, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY, db_version TEXT, size INTEGER,
+            last_used REAL, value BLOB)"""
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)"
+        )
+        _cache = (path, conn)
+
+    return _cache[1]
+
+
+def _save_used(conn):
+    """Writes the last use times of the results read since the last write."""
+    if _used:
+        conn.executemany(
+            "UPDATE results SET last_used = ? WHERE key = ?",
+            [(used, key) for key, used in _used.items()],
+        )
+        _used.clear()
+
+
+def _evict(conn):
+    """Drops the least recently used results until the cache fits max_bytes."""
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    if total <= max_bytes:
+        return
+
+    rows = conn.execute("SELECT key, size FROM results ORDER BY last_used").fetchall()
+    for key, size in rows:
+        if total <= max_bytes:
+            break
+        conn.execute("DELETE FROM results WHERE key = ?", (key,))
+        total -= size
+        _stats["cache_evictions"] += 1
+
+
+def cached(kind, query, params, run):
+    """Returns the cached result of the query or runs and caches it.
+
+    Results cached before the database last changed are never returned.
+
+    Args:
+        kind: type of result, see cache_key.
+        query: SQL query string.
+        params: query parameters.
+        run: function without arguments that runs the query.
+
+    Returns:
+        result of run.
+    """
+    if not enabled:
+        return run()
+
+    key = cache_key(kind, query, params)
+    version = db_version()
+
+    with _lock:
+        conn = _connection()
+        row = conn.execute(
+            "SELECT value FROM results WHERE key = ? AND db_version = ?",
+            (key, version),
+        ).fetchone()
+
+        if row is not None:
+            _used[key] = time.time()
+            _stats["cache_hits"] += 1
+        else:
+            _stats["cache_misses"] += 1
+
+    if row is not None:
+        return pickle.loads(row[0])
+
+    result = run()
+    value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+
+    with _lock:
+        conn = _connection()
+        _save_used(conn)
+        conn.execute("DELETE FROM results WHERE db_version != ?", (version,))
+        conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (key, version, len(value), time.time(), value),
+        )
+        _evict(conn)
+
+    return result
+
+
+def clear_cache():
+    """Drops every cached result."""
+    with _lock:
+        _used.clear()
+        _connection().execute("DELETE FROM results")
+
+
+def close_cache():
+    """Closes the cache connection, it is reopened when next used."""
+    global _cache
+
+    with _lock:
+        if _cache is not None:
+            _save_used(_cache[1])
+            _cache[1].close()
+            _cache = None
+
+
+def cache_stats():
+    """Returns a copy of the cache hit, miss and eviction counts."""
+    with _lock:
+        return dict(_stats)
@@ -1,34 +1,247 @@
 import argparse
-from enrollment import hpms_enrollment
-from med_errors import med_errors
-from pneumo import pneumo_vacc
-from influenza import influ_vacc
-from paceutils import Helpers
-from filepath import create_dir_if_needed, db_filepath
+import importlib
+import time
+from periods import parse_quarter, quarters_between
+import profiler
+import query_cache
+import history_store
+import status_store
+from database import get_helpers, close_connections, connection_stats
+from pipeline import report_stages, run_stages
 
 
-def hpms_reporting_wrapper(q=None, yr=None):
+def stage_summary(results):
+    """Formats the results of run_stages, one line per stage."""
+    lines = []
+    for name, seconds, result in results:
+        if isinstance(result, Exception):
+            result = f"FAILED {type(result).__name__}: {result}"
+        lines.append(f"{name:<28}{seconds:>8.2f}s  {result}")
+
+    return "\n".join(lines)
+
+
+def connection_summary():
+    """Formats the connection counts and timings of the database module."""
+    stats = connection_stats()
+
+    return (
+        f"{stats['queries']} queries on {stats['connections_opened']} connections "
+        f"(opened in {stats['open_seconds']:.3f}s, "
+        f"closed in {stats['close_seconds']:.3f}s), "
+        f"{stats['cache_hits']} cache hits, {stats['cache_misses']} cache misses"
+    )
+
+
+def import_times(modules=None):
+    """Measures how long each dependency and stage module takes to import.
+
+    Modules are imported in order so each time only includes what earlier
+    modules did not already import. Run in a fresh interpreter for
+    meaningful numbers, python -X importtime gives a finer breakdown.
+
+    Args:
+        modules: list of module names, defaults to the heavy dependencies
+        followed by the stage modules.
+
+    Returns:
+        list of (module, seconds) tuples.
+    """
+    if modules is None:
+        modules = [
+            "numpy",
+            "pandas",
+            "paceutils",
+            "database",
+            "vaccination",
+            "enrollment",
+            "med_errors",
+            "pneumo",
+            "influenza",
+        ]
+
+    times = []
+    for module in modules:
+        start = time.perf_counter()
+        importlib.import_module(module)
+        times.append((module, time.perf_counter() - start))
+
+    return times
+
+
+def hpms_reporting_wrapper(q=None, yr=None, jobs=None):
     if q is None:
-        helpers = Helpers(db_filepath)
-        q, yr = helpers.last_quarter(return_q=True)
+        q, yr = get_helpers().last_quarter(return_q=True)
+
+    return run_stages(report_stages(q, yr), jobs)
+
+
+def hpms_backfill(start, end=None, jobs=None):
+    """Runs every report for each quarter from start to end.
 
-    create_dir_if_needed(q, yr)
-    hpms_enrollment(q, yr)
-    med_errors(q, yr)
-    pneumo_vacc(q, yr)
+    The enrollment, med error and vaccination records for the whole range
+    are loaded once and each quarter's reports are computed from them.
+    The stages of every quarter run as one graph, so later quarters do
+    not wait for the slowest stage of earlier ones.
 
-    if (q == 4) | (q == 1):
-        influ_vacc(q, yr)
+    Args:
+        start: first quarter to run, written as {year}Q{quarter}.
+        end: last quarter to run, written as {year}Q{quarter},
+        defaults to the last quarter.
+        jobs: number of report stages to run at the same time, defaults
+        to the number of CPUs.
+
+    Returns:
+        list of run_stages results for every stage of every quarter.
+    """
+    from enrollment import enrollment_frame
+    from med_errors import incidents_frame
+    from vaccination import vaccination_frame
+
+    helpers = get_helpers()
+
+    if end is None:
+        last_quarter = helpers.last_quarter(return_q=True)
+    else:
+        last_quarter = parse_quarter(end)
+
+    quarters = quarters_between(parse_quarter(start), last_quarter)
+
+    params = (
+        helpers.get_quarter_dates(*quarters[0])[0],
+        helpers.get_quarter_dates(*quarters[-1])[1],
+    )
+
+    preloaded = {
+        "enrollments": enrollment_frame(params),
+        "incidents": incidents_frame(params),
+        "pneumo": vaccination_frame("pneumo", params, min_age=65),
+        "influ": vaccination_frame("influ", params),
+    }
+
+    stages = []
+    for q, yr in quarters:
+        stages += report_stages(q, yr, preloaded, prefix=f"{yr}Q{q} ")
+
+    return run_stages(stages, jobs)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("--q", default=None, help="Number of quarter")
-    parser.add_argument("--yr", default=None, help="Year of quarter")
+    parser.add_argument("--q", default=None, type=int, help="Number of quarter")
+    parser.add_argument("--yr", default=None, type=int, help="Year of quarter")
+    parser.add_argument(
+        "--from",
+        dest="start",
+        default=None,
+        help="First quarter to backfill, i.e. 2018Q1",
+    )
+    parser.add_argument(
+        "--to",
+        dest="end",
+        default=None,
+        help="Last quarter to backfill, i.e. 2019Q4. Defaults to last quarter",
+    )
+    parser.add_argument(
+        "--jobs",
+        default=None,
+        type=int,
+        help="Number of report stages to run at the same time, defaults to CPUs",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Run every query against the database instead of the query cache",
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Do not add the reports to the Parquet history store",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only classify members with rows added since the last run",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Classify every member again when running with --incremental",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time stages, queries and file writes and write a trace file",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running, re-run the reports the database changes affect "
+        "and serve the results as JSON (implies --incremental)",
+    )
+    parser.add_argument(
+        "--interval",
+        default=5.0,
+        type=float,
+        help="Seconds between database checks with --watch",
+    )
+    parser.add_argument(
+        "--port",
+        default=8765,
+        type=int,
+        help="Local port of the JSON endpoint with --watch",
+    )
+    parser.add_argument(
+        "--import-times",
+        action="store_true",
+        help="Print how long each module takes to import and exit",
+    )
 
     arguments = parser.parse_args()
 
-    hpms_reporting_wrapper(**vars(arguments))
+    if arguments.import_times:
+        times = import_times()
+        for module, seconds in times:
+            print(f"{module:<20}{seconds:>8.3f}s")
+        print(f"{'total':<20}{sum(seconds for _, seconds in times):>8.3f}s")
+        raise SystemExit()
+
+    query_cache.enabled = not arguments.no_cache
+    history_store.enabled = not arguments.no_history
+    profiler.enabled = arguments.profile
+    status_store.enabled = arguments.incremental or arguments.watch
+
+    if status_store.enabled and arguments.rebuild:
+        status_store.clear_store()
+
+    if arguments.watch:
+        from watch import watch
+
+        print(f"Serving the reports at http://127.0.0.1:{arguments.port}/")
+        results = watch(
+            arguments.q,
+            arguments.yr,
+            arguments.jobs,
+            arguments.interval,
+            arguments.port,
+        )
+    elif arguments.start is not None:
+        results = hpms_backfill(arguments.start, arguments.end, arguments.jobs)
+    else:
+        results = hpms_reporting_wrapper(arguments.q, arguments.yr, arguments.jobs)
+
+    close_connections()
+    query_cache.close_cache()
+    status_store.close_store()
+
+    print(stage_summary(results))
+    print(connection_summary())
+
+    if arguments.profile:
+        profiler.report()
+
+    if any(isinstance(result, Exception) for _, _, result in results):
+        raise SystemExit("One or more stages failed")
 
     print("Complete!")
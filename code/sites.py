@@ -0,0 +1,65 @@
+from database import fetchall_query
+from periods import enrolled_filter
+
+# HPMS site name and upload file suffix of each center, centers found in
+# the database but missing here are named after organization_name
+organization_name = "PACE Rhode Island"
+
+site_registry = {
+    "Providence": {"site_name": "PACE Rhode Island - Providence", "suffix": "pvd"},
+    "Woonsocket": {"site_name": "PACE Rhode Island - Woonsocket", "suffix": "woon"},
+    "Westerly": {"site_name": "PACE Rhode Island - Westerly", "suffix": "wes"},
+}
+
+centers_query = f"""
+    SELECT DISTINCT center FROM enrollment WHERE {enrolled_filter()}
+    """
+
+
+def report_centers(params):
+    """Lists the centers to report on for the period.
+
+    Every center in site_registry, in registry order, followed by any
+    other center with members enrolled during the period.
+
+    Args:
+        params: tuple of start and end date of the period.
+
+    Returns:
+        list of center names.
+    """
+    enrolled = sorted(
+        row[0] for row in fetchall_query(centers_query, params) if row[0] is not None
+    )
+
+    return list(site_registry) + [
+        center for center in enrolled if center not in site_registry
+    ]
+
+
+def site_name(center):
+    """Returns the HPMS site name of the center."""
+    if center in site_registry:
+        return site_registry[center]["site_name"]
+
+    return f"{organization_name} - {center}"
+
+
+def registered_site_names():
+    """Lists the HPMS site names of the centers in site_registry."""
+    return [site["site_name"] for site in site_registry.values()]
+
+
+def site_file_suffix(site):
+    """Returns the suffix of the upload file name of an HPMS site name.
+
+    Sites of centers missing from site_registry use the part of the site
+    name after the last " - ", i.e. "PACE Rhode Island - Newport"
+    becomes "newport".
+    """
+    for registered in site_registry.values():
+        if registered["site_name"] == site:
+            return registered["suffix"]
+
+    return site.split(" - ")[-1].strip().lower().replace(" ", "_")
+
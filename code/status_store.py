@@ -0,0 +1,384 @@
+import os
+import sqlite3
+import threading
+import filepath
+import query_cache
+from database import fetchall_query
+
+# per member HPMS buckets of every report period, kept in a SQLite file in
+# the output folder and brought up to date from the rows changed in the
+# database since the last update
+enabled = False
+
+_lock = threading.Lock()
+_store = None
+
+# marks of the source tables at the current database version, shared by
+# every category and the watch loop so each table is marked once a run
+_marks = (None, {})
+
+# every insert, update and delete on a source table logs the member it
+# changes, created in the report database by prepare_db.py
+change_log_query = """
+    CREATE TABLE IF NOT EXISTS hpms_changes (
+    change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source_table TEXT, member_id INTEGER)
+    """
+
+change_log_index_query = """
+    CREATE INDEX IF NOT EXISTS hpms_changes_source_table_change_id
+    ON hpms_changes (source_table, change_id)
+    """
+
+change_events = {
+    "insert": "VALUES ('{table}', NEW.member_id)",
+    "update": "SELECT '{table}', OLD.member_id UNION SELECT '{table}', NEW.member_id",
+    "delete": "VALUES ('{table}', OLD.member_id)",
+}
+
+triggers_query = """
+    SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?
+    """
+
+last_change_query = """
+    SELECT COALESCE(MAX(change_id), 0) FROM hpms_changes WHERE source_table = ?
+    """
+
+changes_query = """
+    SELECT DISTINCT member_id FROM hpms_changes
+    WHERE source_table = ? AND change_id > ? AND change_id <= ?
+    AND member_id IS NOT NULL
+    """
+
+
+def store_filepath():
+    """Returns the path of the status store, in the output folder."""
+    return f"{filepath.filepath}\\status_store.db"
+
+
+def _connection():
+    """Returns the store connection, opening it if the output folder moved."""
+    global _store
+
+    path = store_filepath()
+
+    if _store is None or _store[0] != path:
+        os.makedirs(filepath.filepath, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        with conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS member_status (
+                category TEXT, period TEXT, member_id INTEGER,
+                center TEXT, bucket TEXT,
+                PRIMARY KEY (category, period, member_id, center, bucket))"""
+            )
+            # counts and bucket lists are read by bucket and center
+            conn.execute(
+                """CREATE INDEX IF NOT EXISTS member_status_bucket
+                ON member_status (category, period, bucket, center)"""
+            )
+            # last_change has no type, it holds a change id or a
+            # database version
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS source_marks (
+                category TEXT, period TEXT, source_table TEXT, last_change,
+                PRIMARY KEY (category, period, source_table))"""
+            )
+        _store = (path, conn)
+
+    return _store[1]
+
+
+def period_key(params):
+    """Returns the store key of the period, i.e. 2019-01-01:2019-03-31."""
+    return f"{params[0]}:{params[1]}"
+
+
+def change_triggers(table):
+    """Returns the name and SQL of each change log trigger of the table."""
+    return {
+        f"hpms_changes_{table}_{event}": f"""
+        CREATE TRIGGER IF NOT EXISTS hpms_changes_{table}_{event}
+        AFTER {event.upper()} ON {table} BEGIN
+        INSERT INTO hpms_changes (source_table, member_id)
+        {rows.format(table=table)};
+        END"""
+        for event, rows in change_events.items()
+    }
+
+
+def table_mark(table, fetch=fetchall_query):
+    """Returns the change mark of the table.
+
+    With the change log triggers of prepare_db.py the mark is the id of
+    the last change logged for the table, so only the table's own
+    changes move it. Without them it is the database version and any
+    change to the database moves it. Marks are kept until the database
+    version changes, so the tables of several categories are only marked
+    once a run.
+
+    Args:
+        table: name of the table.
+        fetch: function of a query and parameters returning all rows,
+        defaults to the pooled connection.
+
+    Returns:
+        int change id, or string database version.
+    """
+    global _marks
+
+    key = (str(filepath.db_filepath), query_cache.db_version())
+
+    with _lock:
+        if _marks[0] != key:
+            _marks = (key, {})
+        if table in _marks[1]:
+            return _marks[1][table]
+
+    triggers = {row[0] for row in fetch(triggers_query, (table,))}
+
+    if set(change_triggers(table)) <= triggers:
+        mark = fetch(last_change_query, (table,))[0][0]
+    else:
+        mark = key[1]
+
+    with _lock:
+        if _marks[0] == key:
+            _marks[1][table] = mark
+
+    return mark
+
+
+def changed_members(category, period, tables):
+    """Finds the members with rows changed in the tables since the last update.
+
+    The members are read from the change log entries between the stored
+    and the current mark of each table. Without a change log, or after
+    it was emptied, every member has to be classified again.
+
+    Args:
+        category: status category, i.e. pneumo.
+        period: period_key of the period.
+        tables: source tables of the category.
+
+    Returns:
+        tuple of a set of member ids, or None if every member has to be
+        classified again, and the new marks of the tables.
+    """
+    with _lock:
+        old_marks = dict(
+            _connection().execute(
+                """SELECT source_table, last_change FROM source_marks
+                WHERE category = ? AND period = ?""",
+                (category, period),
+            )
+        )
+
+    members = set()
+    marks = {}
+    for table in tables:
+        marks[table] = mark = table_mark(table)
+        old_mark = old_marks.get(table)
+
+        if mark == old_mark:
+            continue
+
+        if not isinstance(mark, int) or not isinstance(old_mark, int) or (
+            mark < old_mark
+        ):
+            members = None
+        elif members is not None:
+            members.update(
+                row[0] for row in fetchall_query(changes_query, (table, old_mark, mark))
+            )
+
+    return members, marks
+
+
+def update_status(category, params, tables, fetch, classify, rebuild=False):
+    """Brings the stored buckets of the category up to date for the period.
+
+    Args:
+        category: status category, i.e. pneumo.
+        params: tuple of start and end date of the period.
+        tables: source tables of the category, see changed_members.
+        fetch: function of a list of member ids, or None for every member,
+        returning the records to classify.
+        classify: function of the fetched records returning a DataFrame of
+        member_id, center and bucket rows.
+        rebuild: if True every member is classified again.
+
+    Returns:
+        number of members classified again, None if every member was.
+    """
+    period = period_key(params)
+    members, marks = changed_members(category, period, tables)
+
+    if rebuild:
+        members = None
+
+    if members is not None and not members:
+        return 0
+
+    statuses = classify(fetch(None if members is None else sorted(members)))
+    rows = [
+        (category, period, int(member_id), center, bucket)
+        for member_id, center, bucket in statuses[
+            ["member_id", "center", "bucket"]
+        ].itertuples(index=False)
+    ]
+
+    with _lock:
+        conn = _connection()
+        with conn:
+            if members is None:
+                conn.execute(
+                    "DELETE FROM member_status WHERE category = ? AND period = ?",
+                    (category, period),
+                )
+            else:
+                conn.executemany(
+                    """DELETE FROM member_status
+                    WHERE category = ? AND period = ? AND member_id = ?""",
+                    [(category, period, member_id) for member_id in members],
+                )
+            conn.executemany(
+                "INSERT OR IGNORE INTO member_status VALUES (?, ?, ?, ?, ?)", rows
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO source_marks VALUES (?, ?, ?, ?)",
+                [(category, period, table, mark) for table, mark in marks.items()],
+            )
+
+    return None if members is None else len(members)
+
+
+def output_marks(category, params, tables, digest):
+    """Compares the inputs of an output with the ones it was last saved with.
+
+    Args:
+        category: name of the output, i.e. missed_pneumo.
+        params: tuple of start and end date of the period.
+        tables: tables the output is read from.
+        digest: string identifying the other inputs of the output.
+
+    Returns:
+        tuple of the marks of the inputs, for save_marks once the output
+        is written, and whether they are the same as the saved ones.
+    """
+    marks = {table: table_mark(table) for table in tables}
+    marks["digest"] = digest
+
+    with _lock:
+        saved = dict(
+            _connection().execute(
+                """SELECT source_table, last_change FROM source_marks
+                WHERE category = ? AND period = ?""",
+                (category, period_key(params)),
+            )
+        )
+
+    return marks, saved == marks
+
+
+def save_marks(category, params, marks):
+    """Saves the output_marks of an output once it is written."""
+    period = period_key(params)
+
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.execute(
+                "DELETE FROM source_marks WHERE category = ? AND period = ?",
+                (category, period),
+            )
+            conn.executemany(
+                "INSERT INTO source_marks VALUES (?, ?, ?, ?)",
+                [(category, period, table, mark) for table, mark in marks.items()],
+            )
+
+
+def status_counts(category, params, buckets, centers):
+    """Counts the members in each bucket of every center.
+
+    A member is stored once for each of its buckets at a center, so the
+    rows are counted.
+
+    Args:
+        category: status category, i.e. pneumo.
+        params: tuple of start and end date of the period.
+        buckets: buckets to count, in order.
+        centers: centers to count, in order.
+
+    Returns:
+        pandas DataFrame where each row is a bucket and each column a center.
+    """
+    import pandas as pd
+
+    with _lock:
+        counts = pd.read_sql_query(
+            """SELECT bucket, center, COUNT(*) AS members
+            FROM member_status WHERE category = ? AND period = ?
+            GROUP BY bucket, center""",
+            _connection(),
+            params=(category, period_key(params)),
+        )
+
+    return (
+        counts.pivot(index="bucket", columns="center", values="members")
+        .reindex(index=buckets, columns=centers)
+        .fillna(0)
+        .astype(int)
+    )
+
+
+def status_buckets(category, params, buckets, centers):
+    """Returns the members of each bucket of every center.
+
+    Only the rows of the given buckets are read.
+
+    Returns:
+        dict of center to a dict of bucket to a sorted NumPy array
+        of member ids.
+    """
+    import numpy as np
+    import pandas as pd
+
+    with _lock:
+        statuses = pd.read_sql_query(
+            f"""SELECT center, bucket, member_id FROM member_status
+            WHERE category = ? AND period = ?
+            AND bucket IN ({", ".join(["?"] * len(buckets))})
+            ORDER BY member_id""",
+            _connection(),
+            params=[category, period_key(params)] + list(buckets),
+        )
+
+    members = statuses.groupby(["center", "bucket"])["member_id"].apply(np.array)
+    no_members = np.array([], dtype=int)
+
+    return {
+        center: {
+            bucket: members.get((center, bucket), no_members) for bucket in buckets
+        }
+        for center in centers
+    }
+
+
+def clear_store():
+    """Drops every stored status, the next update classifies every member."""
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.execute("DELETE FROM member_status")
+            conn.execute("DELETE FROM source_marks")
+
+
+def close_store():
+    """Closes the store connection, it is reopened when next used."""
+    global _store
+
+    with _lock:
+        if _store is not None:
+            _store[1].close()
+            _store = None
@@ -0,0 +1,337 @@
+import argparse
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from med_errors import rename_columns
+
+default_centers = ["Providence", "Woonsocket", "Westerly"]
+
+locations = [
+    "ADHC/Clinic",
+    "Alternative Care Setting",
+    "ALF/PCBH",
+    "Home/Independent Living",
+    "Hospital",
+    "Inpatient Hospice",
+    "Nursing Home",
+]
+
+first_names = ["Mary", "John", "Maria", "Joseph", "Anna", "Manuel", "Rose", "Luis"]
+last_names = ["Silva", "Smith", "Nguyen", "Rodriguez", "Brown", "Costa", "Lee"]
+
+schema = """
+CREATE TABLE enrollment (member_id INTEGER, enrollment_date TEXT,
+    disenrollment_date TEXT, disenroll_type TEXT, center TEXT,
+    medicare INTEGER, medicaid INTEGER);
+CREATE TABLE ppts (member_id INTEGER PRIMARY KEY, first TEXT, last TEXT);
+CREATE TABLE demographics (member_id INTEGER PRIMARY KEY, dob TEXT);
+CREATE TABLE centers (member_id INTEGER PRIMARY KEY, center TEXT);
+CREATE TABLE influ (member_id INTEGER, date_administered TEXT, dose_status INTEGER);
+CREATE TABLE pneumo (member_id INTEGER, date_administered TEXT, dose_status INTEGER);
+"""
+
+
+def iso_dates(days, start):
+    """Converts day offsets from start to ISO date strings."""
+    return (np.datetime64(start) + days).astype(str)
+
+
+def enrollment_records(rng, members, centers, start, end):
+    """Creates the enrollment records of every member.
+
+    Members enroll from three years before start to end, about 40%
+    disenroll, and 5% of those who disenroll enroll again, possibly at
+    another center.
+
+    Returns:
+        pandas DataFrame with the columns of the enrollment table.
+    """
+    span = (np.datetime64(end) - np.datetime64(start)).astype(int)
+
+    member_ids = np.arange(1, members + 1)
+    enrolled = rng.integers(-3 * 365, span, size=members)
+    disenrolled = enrolled + rng.integers(30, 1500, size=members)
+    has_disenrolled = (rng.random(members) < 0.4) & (disenrolled < span)
+
+    reenrolled = has_disenrolled & (rng.random(members) < 0.05)
+    reenrolled_ids = member_ids[reenrolled]
+    reenrolled_dates = disenrolled[reenrolled] + rng.integers(
+        30, 365, size=len(reenrolled_ids)
+    )
+    keep = reenrolled_dates < span
+
+    member_ids = np.concatenate([member_ids, reenrolled_ids[keep]])
+    enrolled = np.concatenate([enrolled, reenrolled_dates[keep]])
+    disenrolled = np.concatenate([disenrolled, np.zeros(keep.sum(), dtype=int)])
+    has_disenrolled = np.concatenate([has_disenrolled, np.zeros(keep.sum(), bool)])
+
+    rows = len(member_ids)
+
+    return pd.DataFrame(
+        {
+            "member_id": member_ids,
+            "enrollment_date": iso_dates(enrolled, start),
+            "disenrollment_date": np.where(
+                has_disenrolled, iso_dates(disenrolled, start), None
+            ),
+            "disenroll_type": np.where(
+                has_disenrolled,
+                rng.choice(
+                    ["Deceased", "Voluntary", "Moved"], size=rows, p=[0.6, 0.3, 0.1]
+                ),
+                None,
+            ),
+            "center": rng.choice(centers, size=rows),
+            "medicare": (rng.random(rows) < 0.9).astype(int),
+            "medicaid": (rng.random(rows) < 0.6).astype(int),
+        }
+    )
+
+
+def vaccination_records(rng, enrollment, start, end, season):
+    """Creates the pneumo or influ records of every member.
+
+    Pneumococcal records are spread over the five years before enrollment
+    through end, influenza members get about one record per flu season.
+    About 2% of members are contraindicated with a single 99 record.
+
+    Returns:
+        pandas DataFrame with the columns of the vaccination tables.
+    """
+    member_ids = enrollment["member_id"].unique()
+    span = (np.datetime64(end) - np.datetime64(start)).astype(int)
+
+    if season:
+        seasons = span // 365 + 4
+        records = rng.binomial(seasons, 0.85, size=len(member_ids))
+    else:
+        records = rng.integers(0, 4, size=len(member_ids))
+
+    contra = rng.random(len(member_ids)) < 0.02
+    records[contra] = 0
+
+    ids = np.repeat(member_ids, records)
+    if season:
+        # flu shots are given from September through March
+        season_start = rng.integers(-3, span // 365 + 1, size=len(ids)) * 365 + 243
+        days = season_start + rng.integers(0, 212, size=len(ids))
+    else:
+        days = rng.integers(-5 * 365, span, size=len(ids))
+
+    vaccinations = pd.DataFrame(
+        {
+            "member_id": ids,
+            "date_administered": iso_dates(days, start),
+            "dose_status": rng.choice([1, 0], size=len(ids), p=[0.75, 0.25]),
+        }
+    )
+    contraindicated = pd.DataFrame(
+        {
+            "member_id": member_ids[contra],
+            "date_administered": None,
+            "dose_status": 99,
+        }
+    )
+
+    return pd.concat([vaccinations, contraindicated], ignore_index=True)
+
+
+def med_error_records(rng, members, start, end, incidents_per_quarter):
+    """Creates incidents_per_quarter med error incidents for every quarter.
+
+    About 90% of incidents have a medication error type and each
+    contributing factor and action is flagged on about 8% of incidents.
+
+    Returns:
+        pandas DataFrame with the columns of the med_errors table.
+    """
+    contributing_map, med_error_map, measures_map = rename_columns(
+        None, return_maps=True
+    )
+
+    quarters = pd.period_range(start, end, freq="Q")
+    incidents = incidents_per_quarter * len(quarters)
+
+    quarter_start = np.repeat(
+        (quarters.start_time.values - np.datetime64(start, "ns"))
+        .astype("timedelta64[D]")
+        .astype(int),
+        incidents_per_quarter,
+    )
+    days = quarter_start + rng.integers(0, 90, size=incidents)
+
+    incident_records = pd.DataFrame(
+        {
+            "member_id": rng.integers(1, members + 1, size=incidents),
+            "date_discovered": iso_dates(days, start),
+            "location": rng.choice(locations, size=incidents),
+            "order_written_correctly": rng.choice(
+                ["1", "0", "Unknown"], size=incidents, p=[0.7, 0.15, 0.15]
+            ),
+            "comments": rng.choice(
+                ["", "Reviewed with staff", "Pharmacy notified"], size=incidents
+            ),
+        }
+    )
+
+    for col in list(contributing_map) + list(measures_map):
+        incident_records[col] = (rng.random(incidents) < 0.08).astype(int)
+
+    med_error_types = list(med_error_map)
+    error_type = rng.integers(0, len(med_error_types), size=incidents)
+    has_type = rng.random(incidents) < 0.9
+    for position, col in enumerate(med_error_types):
+        incident_records[col] = (has_type & (error_type == position)).astype(int)
+
+    return incident_records
+
+
+def create_database(
+    db_filepath,
+    members=10000,
+    centers=None,
+    years=5,
+    last_year=2019,
+    incidents_per_quarter=50,
+    seed=0,
+):
+    """Builds a SQLite database of random members with the report tables.
+
+    Creates the enrollment, ppts, demographics, centers, influ, pneumo and
+    med_errors tables the report queries expect, replacing db_filepath.
+
+    Args:
+        db_filepath: path of the database to create.
+        members: number of members.
+        centers: list of center names, defaults to default_centers.
+        years: number of years of records, ending with last_year.
+        last_year: last year with records.
+        incidents_per_quarter: number of med error incidents per quarter.
+        seed: seed for the random number generator.
+
+    Returns:
+        dict of table name to number of rows.
+    """
+    rng = np.random.default_rng(seed)
+    centers = centers or default_centers
+
+    start = f"{last_year - years + 1}-01-01"
+    end = f"{last_year}-12-31"
+
+    enrollment = enrollment_records(rng, members, centers, start, end)
+    last_enrollment = enrollment.drop_duplicates("member_id", keep="last")
+
+    member_ids = np.arange(1, members + 1)
+    ages = rng.integers(55 * 365, 100 * 365, size=members)
+    enrolled_days = (
+        (
+            pd.to_datetime(enrollment["enrollment_date"].iloc[:members]).values
+            - np.datetime64(start, "ns")
+        )
+        .astype("timedelta64[D]")
+        .astype(int)
+    )
+    has_dob = rng.random(members) < 0.99
+
+    tables = {
+        "enrollment": enrollment,
+        "ppts": pd.DataFrame(
+            {
+                "member_id": member_ids,
+                "first": rng.choice(first_names, size=members),
+                "last": rng.choice(last_names, size=members),
+            }
+        ),
+        "demographics": pd.DataFrame(
+            {
+                "member_id": member_ids[has_dob],
+                "dob": iso_dates(enrolled_days - ages, start)[has_dob],
+            }
+        ),
+        "centers": last_enrollment[["member_id", "center"]],
+        "influ": vaccination_records(rng, enrollment, start, end, season=True),
+        "pneumo": vaccination_records(rng, enrollment, start, end, season=False),
+        "med_errors": med_error_records(
+            rng, members, start, end, incidents_per_quarter
+        ),
+    }
+
+    if os.path.exists(db_filepath):
+        os.remove(db_filepath)
+
+    conn = sqlite3.connect(db_filepath)
+    try:
+        conn.executescript(schema)
+        flag_cols = [
+            col for col_map in rename_columns(None, return_maps=True) for col in col_map
+        ]
+        conn.execute(
+            "CREATE TABLE med_errors (incident_id INTEGER PRIMARY KEY, "
+            "member_id INTEGER, date_discovered TEXT, location TEXT, "
+            "order_written_correctly TEXT, comments TEXT, "
+            + ", ".join(f"{col} INTEGER" for col in flag_cols)
+            + ")"
+        )
+
+        with conn:
+            for table, records in tables.items():
+                columns = list(records.columns)
+                conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join(['?'] * len(columns))})",
+                    records.astype(object)
+                    .where(records.notna(), None)
+                    .itertuples(index=False, name=None),
+                )
+    finally:
+        conn.close()
+
+    return {table: len(records) for table, records in tables.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("db", help="Path of the database to create")
+    parser.add_argument("--members", default=10000, type=int, help="Number of members")
+    parser.add_argument(
+        "--centers",
+        default=",".join(default_centers),
+        help="Comma separated center names",
+    )
+    parser.add_argument("--years", default=5, type=int, help="Years of records")
+    parser.add_argument("--last-year", default=2019, type=int, help="Last year")
+    parser.add_argument(
+        "--incidents",
+        default=50,
+        type=int,
+        help="Number of med error incidents per quarter",
+    )
+    parser.add_argument("--seed", default=0, type=int, help="Random seed")
+    parser.add_argument(
+        "--no-indexes",
+        action="store_true",
+        help="Do not create the report indexes and change log of prepare_db.py",
+    )
+
+    arguments = parser.parse_args()
+
+    rows = create_database(
+        arguments.db,
+        arguments.members,
+        arguments.centers.split(","),
+        arguments.years,
+        arguments.last_year,
+        arguments.incidents,
+        arguments.seed,
+    )
+
+    if not arguments.no_indexes:
+        from prepare_db import create_change_log, create_indexes
+
+        create_indexes(arguments.db)
+        create_change_log(arguments.db)
+
+    for table, count in rows.items():
+        print(f"{table:<16}{count:>10} rows")
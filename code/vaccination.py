@@ -0,0 +1,411 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import profiler
+import status_store
+from database import dataframe_query, member_dataframe_query
+import filepath
+from periods import (
+    shift_date,
+    dates_between,
+    enrolled_during,
+    enrolled_filter,
+    age_cutoff,
+)
+
+BUCKETS = ["eligible", "during", "prior", "refused", "contra", "missed"]
+
+member_details_query = """SELECT e.member_id, p.first, p.last, e.enrollment_date, e.disenrollment_date
+    FROM enrollment e
+    JOIN ppts p on e.member_id=p.member_id
+    WHERE e.member_id IN ({member_ids});"""
+
+
+def vaccination_query(table, min_age=None, by_member=False, windowed=False):
+    """Builds the query of vaccination_frame.
+
+    Args:
+        table: name of the vaccination table (pneumo or influ).
+        min_age: if given the query takes the age_cutoff birth date as
+        one more parameter after the period, see vaccination_params.
+        by_member: if True the query is limited to the members of an
+        IN ({member_ids}) clause, for member_dataframe_query.
+        windowed: if True only contraindications and records administered
+        within a window are joined, the window's first and last dates are
+        the first parameters, see vaccination_window.
+
+    Returns:
+        SQL query string.
+    """
+    age_join = "LEFT JOIN demographics d ON e.member_id = d.member_id"
+    age_filter = ""
+    member_filter = "AND e.member_id IN ({member_ids})" if by_member else ""
+    window_filter = ""
+
+    if by_member:
+        period_filter = enrolled_filter("e")
+    else:
+        # SQLite does not narrow a join down by the OR of enrolled_filter,
+        # the subquery reads the period's records off the disenrollment
+        # date index before the join
+        period_filter = (
+            f"e.rowid IN (SELECT rowid FROM enrollment WHERE {enrolled_filter()})"
+        )
+
+    if windowed:
+        window_filter = (
+            "AND (v.dose_status = 99 OR v.date_administered BETWEEN ? AND ?)"
+        )
+
+    if min_age is not None:
+        age_join = "JOIN demographics d ON e.member_id = d.member_id"
+        age_filter = "AND d.dob < ?"
+
+    return f"""
+    SELECT DISTINCT e.member_id, e.center, e.enrollment_date,
+    e.disenrollment_date, d.dob, v.dose_status, v.date_administered
+    FROM enrollment e
+    LEFT JOIN {table} v ON e.member_id = v.member_id
+    {window_filter}
+    {age_join}
+    WHERE {period_filter}
+    {age_filter}
+    {member_filter}
+    """
+
+
+def vaccination_params(params, min_age=None, window=None):
+    """Returns the parameters of vaccination_query for the period.
+
+    The age check is a birth date cutoff computed once, rather than an
+    age computed for every joined row.
+    """
+    window_params = list(window) if window is not None else []
+
+    if min_age is None:
+        return window_params + list(params)
+
+    return window_params + list(params) + [age_cutoff(params[1], min_age)]
+
+
+def vaccination_window(params, prior_months):
+    """Returns the dates classify_frame looks at for the period.
+
+    Records administered from prior_months before the start date through
+    the day after the end date are the only ones that can be during or
+    prior, so the rest of a member's history does not need to be pulled.
+
+    Args:
+        params: tuple of start and end date of the period.
+        prior_months: see classify_frame, must not be None.
+
+    Returns:
+        tuple of first and last date of the window.
+    """
+    return shift_date(params[0], -prior_months), shift_date(params[1], days=1)
+
+
+def vaccination_frame(table, params, min_age=None, window=None):
+    """Pulls the vaccination records of every member enrolled during the period.
+
+    One query covers every center and every vaccination status, members
+    without any record in the vaccination table are returned with NULL
+    dose_status and date_administered. The period can span several
+    quarters, classify_frame narrows the records down to each quarter.
+
+    Args:
+        table: name of the vaccination table (pneumo or influ).
+        params: tuple of start and end date of the period.
+        min_age: if given only members at least this old at the end
+        of the period are returned.
+        window: tuple of first and last date of the records to pull,
+        besides contraindications, defaults to every record.
+
+    Returns:
+        pandas DataFrame with member_id, center, enrollment_date,
+        disenrollment_date, dob, dose_status and date_administered columns.
+    """
+    return dataframe_query(
+        vaccination_query(table, min_age, windowed=window is not None),
+        vaccination_params(params, min_age, window),
+    )
+
+
+def eligible_during(frame, params, min_age=None):
+    """Flags the records of members enrolled during the period.
+
+    Args:
+        frame: pandas DataFrame from vaccination_frame.
+        params: tuple of start and end date of the period.
+        min_age: if given only members at least this old at the end
+        of the period are flagged.
+
+    Returns:
+        boolean pandas Series.
+    """
+    eligible = enrolled_during(frame, params)
+
+    if min_age is not None:
+        dob = frame["dob"]
+        eligible &= dob.notna() & (dob.fillna("") < age_cutoff(params[1], min_age))
+
+    return eligible
+
+
+def center_buckets(flags):
+    """Assigns each eligible member of a center to a single HPMS bucket.
+
+    Args:
+        flags: dict of sorted, unique NumPy arrays of member ids for
+        eligible, contra, vacc_during, vacc_prior, refused_during
+        and refused_prior.
+
+    Returns:
+        dict of sorted NumPy arrays of member ids for each of the BUCKETS
+        and missed_actual (missed members who did not refuse previously).
+    """
+    eligible = flags["eligible"]
+    during = flags["vacc_during"]
+    prior = np.setdiff1d(flags["vacc_prior"], during, assume_unique=True)
+    contra = flags["contra"]
+
+    recieved_or_alergic = np.concatenate([prior, during, contra])
+
+    refused_during = flags["refused_during"]
+    refused = refused_during[~np.isin(refused_during, recieved_or_alergic)]
+
+    all_in_vacc = np.concatenate([recieved_or_alergic, refused])
+
+    missed = eligible[~np.isin(eligible, all_in_vacc)]
+
+    if len(missed) != (len(eligible) - len(all_in_vacc)):
+        raise ValueError("Missed does not match eligible - all recieved or refused")
+
+    return {
+        "eligible": eligible,
+        "during": during,
+        "prior": prior,
+        "refused": refused,
+        "contra": contra,
+        "missed": missed,
+        "missed_actual": np.setdiff1d(
+            missed, flags["refused_prior"], assume_unique=True
+        ),
+    }
+
+
+def classify_frame(frame, params, centers, prior_months=None, min_age=None):
+    """Classifies the rows of vaccination_frame into HPMS buckets by center.
+
+    A vaccination or refusal counts as during the period if it was
+    administered between the start date and the day after the end date.
+    Prior vaccinations are any before the start date or, if prior_months
+    is given, those administered in the prior_months before the start date.
+
+    Args:
+        frame: pandas DataFrame from vaccination_frame, may cover
+        more than the period.
+        params: tuple of start and end date of the period.
+        centers: list of centers to return buckets for.
+        prior_months: number of months before the period that count
+        as a prior vaccination, None for any time before.
+        min_age: if given only members at least this old at the end
+        of the period are eligible.
+
+    Returns:
+        dict of center to the center_buckets of its members.
+    """
+    frame = frame.loc[eligible_during(frame, params, min_age)]
+
+    start, end = str(params[0]), str(params[1])
+    during_end = shift_date(end, days=1)
+
+    dose_status = frame["dose_status"].to_numpy()
+    administered = frame["date_administered"]
+
+    is_during = dates_between(administered, start, during_end).to_numpy()
+
+    if prior_months is None:
+        is_prior = (administered.notna() & (administered.fillna("") < start)).to_numpy()
+    else:
+        prior_start = shift_date(start, -prior_months)
+        is_prior = dates_between(administered, prior_start, start).to_numpy()
+
+    masks = {
+        "contra": dose_status == 99,
+        "vacc_during": (dose_status == 1) & is_during,
+        "vacc_prior": (dose_status == 1) & is_prior,
+        "refused_during": (dose_status == 0) & is_during,
+        "refused_prior": (dose_status == 0) & is_prior,
+    }
+
+    members = frame["member_id"].to_numpy()
+    center_rows = frame.groupby("center").indices
+    no_rows = np.array([], dtype=int)
+
+    def classify_center(center):
+        rows = center_rows.get(center, no_rows)
+        center_members = members[rows]
+
+        flags = {"eligible": np.unique(center_members)}
+        for flag, mask in masks.items():
+            flags[flag] = np.unique(center_members[mask[rows]])
+
+        return center_buckets(flags)
+
+    return {center: classify_center(center) for center in centers}
+
+
+def vaccination_status(frame, params, centers, prior_months=None, min_age=None):
+    """Lists the buckets of each member classified by classify_frame.
+
+    Args:
+        frame: pandas DataFrame from vaccination_frame.
+        params: tuple of start and end date of the period.
+        centers: list of centers to classify.
+        prior_months: see classify_frame.
+        min_age: see classify_frame.
+
+    Returns:
+        pandas DataFrame of member_id, center and bucket rows, one for each
+        of the BUCKETS and missed_actual a member is in.
+    """
+    center_buckets_dict = classify_frame(frame, params, centers, prior_months, min_age)
+
+    return pd.concat(
+        [
+            pd.DataFrame({"member_id": members, "center": center, "bucket": bucket})
+            for center, buckets in center_buckets_dict.items()
+            for bucket, members in buckets.items()
+        ],
+        ignore_index=True,
+    )
+
+
+def stored_buckets(
+    table, params, centers, prior_months=None, min_age=None, window=None, buckets=None
+):
+    """Classifies members through the status store instead of from scratch.
+
+    Only members with enrollment, demographics or vaccination rows added
+    since the store was last updated for the period are classified again.
+
+    Args:
+        table: name of the vaccination table (pneumo or influ).
+        params: tuple of start and end date of the period.
+        centers: list of centers to return buckets for.
+        prior_months: see classify_frame.
+        min_age: see classify_frame.
+        window: see vaccination_frame.
+        buckets: buckets to return, defaults to every bucket, see
+        stored_counts for the bucket counts.
+
+    Returns:
+        dict of center to its buckets, like classify_frame.
+    """
+    if buckets is None:
+        buckets = BUCKETS + ["missed_actual"]
+
+    def fetch(member_ids):
+        if member_ids is None:
+            return vaccination_frame(table, params, min_age, window)
+
+        return member_dataframe_query(
+            vaccination_query(
+                table, min_age, by_member=True, windowed=window is not None
+            ),
+            member_ids,
+            vaccination_params(params, min_age, window),
+        )
+
+    def classify(frame):
+        return vaccination_status(frame, params, centers, prior_months, min_age)
+
+    status_store.update_status(
+        table, params, ["enrollment", "demographics", table], fetch, classify
+    )
+
+    return status_store.status_buckets(table, params, buckets, centers)
+
+
+def stored_counts(table, params, centers):
+    """Counts the members in each of the BUCKETS after stored_buckets.
+
+    Counted in the status store, so members are not read to be counted.
+
+    Returns:
+        pandas DataFrame where each row is one of the BUCKETS and each
+        column a center, like the bucket_counts of every center.
+    """
+    counts = status_store.status_counts(table, params, BUCKETS, centers)
+    counts.columns.name = None
+
+    return counts
+
+
+def bucket_counts(buckets):
+    """Returns the number of members in each of the BUCKETS, in order."""
+    return [len(buckets[bucket]) for bucket in BUCKETS]
+
+
+def missed_path(filename, quarter, year):
+    """Returns the path of a missed list, see missed_list_for_nursing."""
+    return f"{filepath.filepath}\\{year}Q{quarter}\\missed_vacc\\{filename}.csv"
+
+
+def missed_list_for_nursing(missed_lists, quarter, year):
+    """Writes the lists of missed members for nursing to follow up on.
+
+    The member details for every list are fetched together and each
+    list is written once, to missed_vacc/{file name}.csv.
+
+    Args:
+        missed_lists: dict of file name to the member ids missed across
+        every center.
+        quarter: quarter number.
+        year: year of the quarter.
+    """
+    missed = np.concatenate(list(missed_lists.values()))
+
+    member_details = member_dataframe_query(member_details_query, missed)
+
+    for filename, members in missed_lists.items():
+        missed_details = member_details[member_details["member_id"].isin(members)]
+        missed_details = missed_details.drop_duplicates()
+        path = missed_path(filename, quarter, year)
+        with profiler.span("write", path, rows=len(missed_details)):
+            missed_details.to_csv(path, index=False)
+
+
+def stored_missed_lists(table, params, missed_lists, quarter, year):
+    """Writes the missed lists through the status store.
+
+    The lists only change with their members or the enrollment and ppts
+    rows of those members, so they are written, and the member details
+    fetched, only when either changed since the lists were last written.
+
+    Args:
+        table: name of the vaccination table (pneumo or influ).
+        params: tuple of start and end date of the period.
+        missed_lists: see missed_list_for_nursing.
+        quarter: quarter number.
+        year: year of the quarter.
+    """
+    digest = hashlib.sha256()
+    for filename, members in missed_lists.items():
+        digest.update(filename.encode())
+        digest.update(np.unique(np.asarray(members, dtype=np.int64)).tobytes())
+
+    marks, unchanged = status_store.output_marks(
+        f"missed_{table}", params, ["enrollment", "ppts"], digest.hexdigest()
+    )
+
+    if unchanged and all(
+        os.path.exists(missed_path(filename, quarter, year))
+        for filename in missed_lists
+    ):
+        return
+
+    missed_list_for_nursing(missed_lists, quarter, year)
+    status_store.save_marks(f"missed_{table}", params, marks)
@@ -0,0 +1,253 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import filepath
+import query_cache
+import status_store
+from database import connect
+from periods import date_quarter
+from pipeline import report_stages, run_stages, stage_registry, stage_subset
+
+_lock = threading.Lock()
+_state = {}
+
+
+def database_version(conn):
+    """Identifies the current contents of the database.
+
+    PRAGMA data_version changes when another connection commits to the
+    database, the file version catches the file being replaced.
+
+    Args:
+        conn: connection kept open between checks.
+
+    Returns:
+        tuple of the file version and data_version.
+    """
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+
+    return query_cache.db_version(), data_version
+
+
+def table_marks(conn, tables):
+    """Returns the status_store.table_mark of each table.
+
+    The marks are shared with the status store, so the refresh they
+    trigger does not mark the tables again. A table that can not be read
+    is marked None.
+    """
+
+    def fetch(query, params=()):
+        return conn.execute(query, params).fetchall()
+
+    marks = {}
+    for table in tables:
+        try:
+            marks[table] = status_store.table_mark(table, fetch)
+        except sqlite3.Error:
+            marks[table] = None
+
+    return marks
+
+
+def watched_tables():
+    """Lists every table read by a registered stage."""
+    tables = set()
+    for stage in stage_registry.values():
+        tables.update(stage["tables"] or [])
+
+    return sorted(tables)
+
+
+def affected_stages(changed_tables):
+    """Lists the registered stages reading any of the changed tables."""
+    return {
+        name
+        for name, stage in stage_registry.items()
+        if stage["tables"] is None or set(stage["tables"]) & set(changed_tables)
+    }
+
+
+def report_tables(q, yr):
+    """Loads the quarter's report files for the JSON endpoint.
+
+    Returns:
+        dict of report to its table as index, columns and data lists,
+        med errors are counted by site.
+    """
+    folder = f"{filepath.filepath}\\{yr}Q{q}"
+
+    reports = {}
+    for report in ["enrollment", "pneumo", "influ"]:
+        path = f"{folder}\\hpms_{report}_Q{q}_{yr}.csv"
+        if os.path.exists(path):
+            reports[report] = pd.read_csv(path, index_col=0).to_dict(orient="split")
+
+    path = f"{folder}\\hpms_med_errors_Q{q}_{yr}.csv"
+    if os.path.exists(path):
+        sites = pd.read_csv(path, usecols=["Site Name"])["Site Name"]
+        reports["med_errors"] = {
+            "incidents": len(sites),
+            "by_site": sites.value_counts().to_dict(),
+        }
+
+    return reports
+
+
+def refresh(q, yr, names, executor):
+    """Runs the named stages for the quarter and publishes the results.
+
+    Returns:
+        list of run_stages results.
+    """
+    start = time.perf_counter()
+    results = run_stages(stage_subset(report_stages(q, yr), names), executor=executor)
+    seconds = time.perf_counter() - start
+
+    with _lock:
+        _state.update(
+            {
+                "quarter": q,
+                "year": yr,
+                "refreshed": datetime.datetime.now().isoformat(timespec="seconds"),
+                "refresh_seconds": seconds,
+                "refreshes": _state.get("refreshes", 0) + 1,
+                "stages": [
+                    {
+                        "stage": name,
+                        "seconds": stage_seconds,
+                        "failed": isinstance(result, Exception),
+                        "result": (
+                            f"{type(result).__name__}: {result}"
+                            if isinstance(result, Exception)
+                            else result
+                        ),
+                    }
+                    for name, stage_seconds, result in results
+                ],
+                "reports": report_tables(q, yr),
+            }
+        )
+
+    return results
+
+
+def json_value(value):
+    """Converts NumPy numbers in the report tables for json.dumps."""
+    if hasattr(value, "item"):
+        return value.item()
+
+    return str(value)
+
+
+def status():
+    """Returns the results of the last refresh as JSON."""
+    with _lock:
+        return json.dumps(_state, default=json_value)
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """Serves the last refresh at / as JSON."""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/":
+            self.send_error(404)
+            return
+
+        body = status().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    """Starts the JSON endpoint on a background thread.
+
+    Returns:
+        the running ThreadingHTTPServer, call shutdown to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), StatusHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def watch(q=None, yr=None, jobs=None, interval=5.0, port=8765):
+    """Keeps the quarter's reports up to date until interrupted.
+
+    Every stage runs once, then the database is checked every interval
+    seconds and only the stages reading a changed table run again. The
+    stage threads, their database connections and the status store stay
+    open between refreshes, so a refresh only classifies the members
+    with changed rows. Changes are found from the change log of
+    prepare_db.py, without it any change runs every stage again.
+
+    Args:
+        q: quarter to report on, defaults to the current quarter and
+        moves on with it.
+        yr: year of the quarter.
+        jobs: number of stages to run at the same time, defaults to the
+        number of CPUs.
+        interval: seconds between database checks.
+        port: local port of the JSON endpoint, None to not serve it.
+
+    Returns:
+        list of run_stages results of the last refresh.
+    """
+    conn = connect()
+    executor = ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1)
+    server = serve(port) if port is not None else None
+
+    tables = watched_tables()
+    quarter = version = marks = None
+    results = []
+
+    try:
+        while True:
+            current = q, yr
+            if q is None:
+                current = date_quarter(datetime.date.today())
+            last_version, version = version, database_version(conn)
+
+            names = set()
+            if current != quarter:
+                names = set(stage_registry)
+                marks = table_marks(conn, tables)
+            elif version != last_version:
+                last_marks, marks = marks, table_marks(conn, tables)
+                names = affected_stages(
+                    [table for table in tables if marks[table] != last_marks[table]]
+                )
+            quarter = current
+
+            if names:
+                start = time.perf_counter()
+                results = refresh(quarter[0], quarter[1], names, executor)
+                failed = sum(isinstance(result, Exception) for _, _, result in results)
+                print(
+                    f"{datetime.datetime.now():%H:%M:%S} {quarter[1]}Q{quarter[0]} "
+                    f"refreshed {len(results)} stages in "
+                    f"{time.perf_counter() - start:.3f}s, {failed} failed"
+                )
+
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+        executor.shutdown(wait=True)
+        conn.close()
+
+    return results
@@ -0,0 +1,108 @@
+import os
+import shutil
+import sqlite3
+import sys
+import pytest
+
+# the report modules are run from code/ and import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "code"))
+
+# quarters checked against the original per-bucket queries, Q4 and Q1
+# cover the flu season and the edge case members below
+quarters = [(1, 2018), (3, 2018), (4, 2019), (1, 2019)]
+
+# members added to the synthetic database for the cases the generator
+# only produces by chance, ids are past the generated members
+edge_cases = {
+    "enrollment": [
+        # moves from Providence to Westerly during 2019Q4
+        (90001, "2017-05-01", "2019-11-14", "Moved", "Providence", 1, 1),
+        (90001, "2019-11-15", None, None, "Westerly", 1, 1),
+        # re-enrolls at Woonsocket within 2019Q4
+        (90002, "2018-02-01", "2019-10-20", "Voluntary", "Woonsocket", 1, 0),
+        (90002, "2019-12-01", None, None, "Woonsocket", 1, 0),
+        # NULL dob, no demographics row and contraindicated
+        (90003, "2016-01-01", None, None, "Providence", 0, 1),
+        (90004, "2016-01-01", None, None, "Westerly", 1, 1),
+        (90005, "2016-01-01", None, None, "Woonsocket", 0, 0),
+    ],
+    "demographics": [
+        (90001, "1940-06-01"),
+        (90002, "1945-01-01"),
+        (90003, None),
+        (90005, "1930-03-15"),
+    ],
+    "pneumo": [
+        (90001, "2019-12-01", 1),
+        (90002, "2019-10-10", 0),
+        (90003, "2019-11-01", 1),
+        (90004, "2019-11-01", 1),
+        (90005, None, 99),
+        (90005, "2019-11-20", 0),
+    ],
+    "influ": [
+        (90001, "2019-09-15", 1),
+        (90002, "2019-10-10", 0),
+        (90003, "2019-12-20", 1),
+        (90005, None, 99),
+        (90005, "2019-11-20", 0),
+    ],
+    "ppts": [(member_id, "Test", "Member") for member_id in range(90001, 90006)],
+}
+
+
+def quarter_dates(quarter, year):
+    """Returns the first and last date of the quarter, like get_quarter_dates."""
+    from periods import shift_date
+
+    start = f"{year}-{3 * quarter - 2:02d}-01"
+
+    return start, shift_date(start, months=3, days=-1)
+
+
+@pytest.fixture(scope="session")
+def synthetic_db(tmp_path_factory):
+    """Builds a small synthetic database with the edge case members added."""
+    from synthetic_db import create_database
+
+    path = str(tmp_path_factory.mktemp("synthetic") / "synthetic.db")
+    create_database(path, members=1500, years=3, seed=1)
+
+    conn = sqlite3.connect(path)
+    with conn:
+        for table, rows in edge_cases.items():
+            conn.executemany(
+                f"INSERT INTO {table} VALUES ({', '.join(['?'] * len(rows[0]))})",
+                rows,
+            )
+    conn.close()
+
+    return path
+
+
+@pytest.fixture
+def report_db(synthetic_db, tmp_path):
+    """Points the reports at a copy of the synthetic database.
+
+    The query cache is off, so tests changing the copy never read stale
+    results.
+    """
+    import database
+    import filepath
+    import query_cache
+    import status_store
+
+    path = str(tmp_path / "report.db")
+    shutil.copy(synthetic_db, path)
+
+    settings = (filepath.db_filepath, filepath.filepath, query_cache.enabled)
+    filepath.configure(path, str(tmp_path / "output"))
+    query_cache.enabled = False
+
+    yield path
+
+    database.close_connections()
+    status_store.close_store()
+    status_store.enabled = False
+    filepath.configure(settings[0], settings[1])
+    query_cache.enabled = settings[2]
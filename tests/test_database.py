@@ -0,0 +1,48 @@
+import sqlite3
+import database
+from database import member_dataframe_query
+from vaccination import member_details_query
+
+
+def test_member_dataframe_query_runs_one_statement_per_batch(report_db, monkeypatch):
+    monkeypatch.setattr(database, "member_batch_size", 7)
+    statements = []
+    run_query = database.dataframe_query
+
+    def counted_query(query, params=()):
+        statements.append((query, len(params)))
+        return run_query(query, params)
+
+    monkeypatch.setattr(database, "dataframe_query", counted_query)
+
+    member_ids = [90001, 90002, 3, 90002] + list(range(10, 26)) + [99999]
+    details = member_dataframe_query(member_details_query, member_ids)
+
+    conn = sqlite3.connect(report_db)
+    expected = conn.execute(
+        member_details_query.format(member_ids=", ".join(["?"] * 20)),
+        sorted(set(member_ids)),
+    ).fetchall()
+    conn.close()
+
+    # 20 distinct members in three batches, the last one padded with NULLs
+    assert len(statements) == 3
+    assert len(set(statements)) == 1
+    assert statements[0][1] == 7
+    assert sorted(details.itertuples(index=False, name=None)) == sorted(expected)
+
+
+def test_member_dataframe_query_past_the_variable_limit(report_db):
+    # more members than SQLite binds in one statement, most of them unknown
+    member_ids = range(1, 40001)
+    details = member_dataframe_query(member_details_query, member_ids)
+
+    conn = sqlite3.connect(report_db)
+    expected = conn.execute(
+        """SELECT COUNT(*) FROM enrollment e
+        JOIN ppts p ON e.member_id = p.member_id
+        WHERE e.member_id BETWEEN 1 AND 40000"""
+    ).fetchone()[0]
+    conn.close()
+
+    assert len(details) == expected > 0
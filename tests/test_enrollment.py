@@ -0,0 +1,112 @@
+import sqlite3
+import pytest
+from conftest import quarter_dates, quarters
+from enrollment import (
+    double_check,
+    enrollment_data,
+    enrollment_frame,
+    hpms_rows,
+    organization_totals,
+)
+
+centers = ["Providence", "Woonsocket", "Westerly"]
+
+census = "(disenrollment_date >= ? OR disenrollment_date IS NULL) AND enrollment_date <= ?"
+enrolled = "enrollment_date BETWEEN ? AND ?"
+disenrolled = "disenrollment_date BETWEEN ? AND ?"
+payers = [
+    "AND medicare = 1 AND medicaid = 1",
+    "AND medicare = 1 AND medicaid = 0",
+    "AND medicare = 0 AND medicaid = 1",
+    "AND medicare = 0 AND medicaid = 0",
+]
+
+# the filters of the paceutils CenterEnrollment methods the report used,
+# in hpms_rows order
+center_enrollment_filters = (
+    [census, enrolled]
+    + [f"{enrolled} {payer}" for payer in payers]
+    + [disenrolled]
+    + [f"{disenrolled} {payer}" for payer in payers]
+    + [f"{disenrolled} AND disenroll_type = 'Deceased'"]
+)
+
+
+def center_enrollment(conn, params):
+    """Counts each row of every center with the CenterEnrollment queries."""
+    return {
+        center: [
+            conn.execute(
+                f"""SELECT COUNT(DISTINCT member_id) FROM enrollment
+                WHERE {where} AND center = ?""",
+                list(params) + [center],
+            ).fetchone()[0]
+            for where in center_enrollment_filters
+        ]
+        for center in centers
+    }
+
+
+def assert_matches_center_enrollment(db_filepath, params, enrollment_df):
+    conn = sqlite3.connect(db_filepath)
+    try:
+        expected = center_enrollment(conn, params)
+    finally:
+        conn.close()
+
+    assert list(enrollment_df.index) == hpms_rows
+    for center in centers:
+        assert enrollment_df[center].tolist() == expected[center], center
+
+
+@pytest.mark.parametrize("quarter, year", quarters)
+def test_enrollment_data_matches_center_enrollment(report_db, quarter, year):
+    params = quarter_dates(quarter, year)
+    enrollments = enrollment_frame(params)
+
+    enrollment_df = enrollment_data(enrollments, params)
+
+    assert_matches_center_enrollment(report_db, params, enrollment_df)
+    assert double_check(enrollment_df, organization_totals(params))
+
+
+def test_transfer_counted_at_both_centers(report_db):
+    # member 90001 moves from Providence to Westerly during 2019Q4
+    params = quarter_dates(4, 2019)
+    enrollments = enrollment_frame(params)
+
+    members = enrollments.loc[enrollments["member_id"] == 90001]
+    assert sorted(members["center"]) == ["Providence", "Westerly"]
+
+    enrollment_df = enrollment_data(enrollments, params)
+    members, transfers = organization_totals(params)["Census"]
+
+    conn = sqlite3.connect(report_db)
+    distinct_members = conn.execute(
+        f"SELECT COUNT(DISTINCT member_id) FROM enrollment WHERE {census}", params
+    ).fetchone()[0]
+    conn.close()
+
+    assert members == distinct_members
+    assert transfers >= 1
+    assert enrollment_df.loc["Census"].sum() == members + transfers
+    assert double_check(enrollment_df, organization_totals(params))
+
+
+def test_miscounted_center_fails_double_check(report_db):
+    params = quarter_dates(4, 2019)
+    enrollment_df = enrollment_data(enrollment_frame(params), params)
+    enrollment_df.loc["Deaths", "Providence"] += 1
+
+    with pytest.raises(ValueError, match="Deaths do not match"):
+        double_check(enrollment_df, organization_totals(params))
+
+
+def test_unreported_center_fails_double_check(report_db):
+    params = quarter_dates(4, 2019)
+    enrollments = enrollment_frame(params)
+
+    enrollment_df = enrollment_data(enrollments, params).drop(columns="Westerly")
+
+    with pytest.raises(ValueError, match="Census does not match"):
+        double_check(enrollment_df, organization_totals(params))
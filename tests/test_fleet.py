@@ -0,0 +1,141 @@
+import json
+import pytest
+import filepath
+import run_hpms_reporting
+import sites
+from fleet import (
+    fleet_summary,
+    load_manifest,
+    organization_failed,
+    run_fleet,
+    run_organization,
+)
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """Restores the database, output, contract and sites after a test."""
+    for module, names in [
+        (filepath, ["db_filepath", "filepath", "contract"]),
+        (sites, ["organization_name", "site_registry"]),
+    ]:
+        for name in names:
+            monkeypatch.setattr(module, name, getattr(module, name))
+
+
+def write_manifest(tmp_path, organizations):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(organizations))
+
+    return str(path)
+
+
+def test_load_manifest_names_organizations_by_contract(tmp_path):
+    organizations = load_manifest(
+        write_manifest(
+            tmp_path,
+            [
+                {"db": "a.db", "contract": "H0001", "output": "a"},
+                {"name": "Other", "db": "b.db", "contract": "H0002", "output": "b"},
+            ],
+        )
+    )
+
+    assert [organization["name"] for organization in organizations] == [
+        "H0001",
+        "Other",
+    ]
+
+
+@pytest.mark.parametrize(
+    "organizations, message",
+    [
+        ([{"db": "a.db", "contract": "H0001"}], "missing \\['output'\\]"),
+        (
+            [
+                {"db": "a.db", "contract": "H0001", "output": "a"},
+                {"db": "b.db", "contract": "H0001", "output": "b"},
+            ],
+            "unique",
+        ),
+    ],
+)
+def test_load_manifest_rejects_bad_entries(tmp_path, organizations, message):
+    with pytest.raises(ValueError, match=message):
+        load_manifest(write_manifest(tmp_path, organizations))
+
+
+def test_run_organization_reports_failed_stages(settings, monkeypatch):
+    runs = []
+
+    def wrapper(q, yr, jobs):
+        runs.append(
+            (filepath.db_filepath, filepath.contract, dict(sites.site_registry))
+        )
+        return [
+            ("enrollment", 0.5, "Complete!"),
+            ("pneumo_vacc", 0.25, ValueError("Census does not match")),
+        ]
+
+    monkeypatch.setattr(run_hpms_reporting, "hpms_reporting_wrapper", wrapper)
+
+    summary = run_organization(
+        {
+            "name": "Other",
+            "db": "other.db",
+            "contract": "H0002",
+            "output": "other",
+            "organization_name": "PACE Other",
+        },
+        4,
+        2019,
+    )
+
+    # another organization's centers are never named after Rhode Island
+    assert runs == [("other.db", "H0002", {})]
+    assert sites.site_name("Newport") == "PACE Other - Newport"
+    assert summary["error"] is None
+    assert [stage["failed"] for stage in summary["stages"]] == [False, True]
+    assert organization_failed(summary)
+    assert "ValueError: Census does not match" in fleet_summary([summary])
+
+
+def test_run_organization_catches_errors(settings, monkeypatch):
+    def wrapper(q, yr, jobs):
+        raise OSError("V: is not available")
+
+    monkeypatch.setattr(run_hpms_reporting, "hpms_reporting_wrapper", wrapper)
+
+    summary = run_organization(
+        {"name": "H0001", "db": "a.db", "contract": "H0001", "output": "a"}
+    )
+
+    assert summary["error"] == "OSError: V: is not available"
+    assert summary["stages"] == []
+    assert fleet_summary([summary]).endswith("0 of 1 organizations complete")
+
+
+def test_run_fleet_isolates_failed_databases(synthetic_db, tmp_path):
+    pytest.importorskip("paceutils")
+
+    organizations = [
+        {
+            "name": "Missing",
+            "db": str(tmp_path / "missing.db"),
+            "contract": "H0001",
+            "output": str(tmp_path / "missing"),
+        },
+        {
+            "name": "Synthetic",
+            "db": synthetic_db,
+            "contract": "H0002",
+            "output": str(tmp_path / "synthetic"),
+        },
+    ]
+
+    summaries = run_fleet(organizations, 4, 2019, processes=2)
+
+    assert [summary["name"] for summary in summaries] == ["Missing", "Synthetic"]
+    assert organization_failed(summaries[0])
+    assert not organization_failed(summaries[1])
+    assert fleet_summary(summaries).endswith("1 of 2 organizations complete")
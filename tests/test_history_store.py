@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+import filepath
+import history_store
+from history_store import partition_writer, quarter_filters, read_history, write_counts
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    """Points the history store at an empty output folder."""
+    # the history store treats a broken pyarrow install as a missing one
+    pytest.importorskip("pyarrow", exc_type=ImportError)
+    monkeypatch.setattr(filepath, "filepath", str(tmp_path / "output"))
+    monkeypatch.setattr(filepath, "contract", "H0001")
+    monkeypatch.setattr(history_store, "enabled", True)
+
+
+def counts(census):
+    """Returns an enrollment report table of the census of two centers."""
+    return pd.DataFrame(
+        {"Providence": [census, 3], "Westerly": [census + 1, 0]},
+        index=pd.Index(["Census", "Dual"]),
+    )
+
+
+def test_quarter_filters():
+    assert quarter_filters() == [[]]
+    assert quarter_filters((2, 2019), (3, 2019)) == [
+        [("year", "=", 2019), ("quarter", ">=", 2), ("quarter", "<=", 3)]
+    ]
+    assert quarter_filters((4, 2018), (1, 2020)) == [
+        [("year", "=", 2018), ("quarter", ">=", 4)],
+        [("year", ">", 2018), ("year", "<", 2020)],
+        [("year", "=", 2020), ("quarter", "<=", 1)],
+    ]
+
+
+def test_counts_round_trip(history):
+    for census, (quarter, year) in enumerate([(3, 2019), (4, 2019), (1, 2020)]):
+        write_counts("enrollment", counts(100 + census), quarter, year)
+
+    rows = read_history("enrollment", "2019Q4", "2020Q1")
+
+    assert rows[["year", "quarter"]].drop_duplicates().values.tolist() == [
+        [2019, 4],
+        [2020, 1],
+    ]
+    census = rows.loc[rows["measure"] == "Census"]
+    assert census["value"].tolist() == [101, 102, 102, 103]
+    assert census["center"].tolist() == [
+        "Providence",
+        "Westerly",
+        "Providence",
+        "Westerly",
+    ]
+    assert set(rows["contract"]) == {"H0001"}
+
+    westerly = read_history(
+        "enrollment", columns=["value"], filters=[("center", "=", "Westerly")]
+    )
+    assert westerly["value"].tolist() == [101, 0, 102, 0, 103, 0]
+
+
+def test_rerun_replaces_partition(history):
+    write_counts("enrollment", counts(100), 4, 2019)
+    write_counts("enrollment", counts(200), 4, 2019)
+
+    rows = read_history("enrollment")
+    assert len(rows) == 4
+    assert rows.loc[rows["measure"] == "Census", "value"].tolist() == [200, 201]
+
+    # a failed run keeps the last partition
+    with pytest.raises(ValueError):
+        with partition_writer("enrollment", 4, 2019) as write:
+            write(counts(300).rename_axis("measure").reset_index())
+            raise ValueError("Census does not match")
+    assert len(read_history("enrollment")) == 4
+
+    # a quarter without rows is removed
+    with partition_writer("enrollment", 4, 2019) as write:
+        write(pd.DataFrame())
+    assert read_history("enrollment").empty
@@ -0,0 +1,53 @@
+import sqlite3
+import influenza
+from conftest import quarter_dates
+from influenza import flu_season_dates, flu_season_frame, flu_season_year
+from vaccination import classify_frame, vaccination_frame, vaccination_window
+
+centers = ["Providence", "Woonsocket", "Westerly"]
+
+
+def test_flu_season_year():
+    assert flu_season_year(4, 2019) == 2020
+    assert flu_season_year("1", "2020") == 2020
+    assert flu_season_year(3, 2019) == 2019
+
+
+def test_flu_season_frame_read_once_per_database_version(report_db, monkeypatch):
+    reads = []
+
+    def counted_frame(*args, **kwargs):
+        reads.append(args)
+        return vaccination_frame(*args, **kwargs)
+
+    monkeypatch.setattr(influenza, "vaccination_frame", counted_frame)
+    influenza.season_frame.cache_clear()
+
+    season = flu_season_frame(2020)
+    assert flu_season_frame("2020") is season
+    assert len(reads) == 1
+
+    conn = sqlite3.connect(report_db)
+    with conn:
+        conn.execute("INSERT INTO influ VALUES (1, '2019-11-06', 1)")
+    conn.close()
+
+    assert flu_season_frame(2020) is not season
+    assert len(reads) == 2
+    influenza.season_frame.cache_clear()
+
+
+def test_quarter_classified_from_season_frame(report_db):
+    # Q4 and Q1 reports classify the quarter from the frame of the season
+    params = quarter_dates(4, 2019)
+    quarter = vaccination_frame("influ", params, window=vaccination_window(params, 2))
+    season = flu_season_frame(2020)
+    influenza.season_frame.cache_clear()
+
+    expected = classify_frame(quarter, params, centers, prior_months=2)
+    center_buckets = classify_frame(season, params, centers, prior_months=2)
+
+    assert flu_season_dates(2020) == ("2019-10-01", "2020-03-31")
+    for center in centers:
+        for bucket, members in expected[center].items():
+            assert sorted(center_buckets[center][bucket]) == sorted(members)
@@ -0,0 +1,109 @@
+import csv
+import pandas as pd
+import filepath
+from conftest import quarter_dates
+from database import dataframe_query
+from filepath import create_dir_if_needed
+from med_errors import (
+    compact_incidents,
+    create_tag_cols,
+    incidents_query,
+    join_tags,
+    rename_columns,
+    upload_frames,
+    write_site_files,
+)
+
+
+def upload_rows(incidents, params, path):
+    """Runs the incidents through upload_frames, returns the files' rows."""
+    frames = list(upload_frames([incidents], params, path, lambda frame: None))
+
+    return pd.concat(frames), pd.read_csv(path, keep_default_na=False)
+
+
+def test_compact_incidents_matches_uncompacted(report_db, tmp_path):
+    params = quarter_dates(4, 2019)
+    incidents = dataframe_query(incidents_query, params)
+
+    # the other factor holds free text details, and flags can be missing
+    details = ["Family brought medication from home", None, 1, 0]
+    incidents["other_contributing_factor"] = [
+        details[row % len(details)] for row in range(len(incidents))
+    ]
+    incidents.loc[incidents.index[::7], "staff_error"] = None
+
+    expected_rows, expected_csv = upload_rows(
+        incidents.copy(), params, str(tmp_path / "uncompacted.csv")
+    )
+    rows, csv = upload_rows(
+        compact_incidents(incidents.copy()), params, str(tmp_path / "compact.csv")
+    )
+
+    assert (expected_csv["Other Contributing Factor"] == details[0]).any()
+    pd.testing.assert_frame_equal(csv, expected_csv)
+    pd.testing.assert_frame_equal(
+        rows.astype(str).reset_index(drop=True),
+        expected_rows.astype(str).reset_index(drop=True),
+    )
+
+
+def test_join_tags_separates_flagged_columns():
+    flags = pd.DataFrame({"A": [1, 0, 0, 1], "B": [0, 0, 1, 1], "C": [1, 0, None, 1]})
+
+    assert list(join_tags(flags, ["A", "B", "C"])) == ["A, C", "", "B", "A, B, C"]
+
+
+def test_create_tag_cols_matches_row_by_row_tags(report_db):
+    incidents = rename_columns(
+        compact_incidents(dataframe_query(incidents_query, quarter_dates(4, 2019)))
+    )
+    tagged = create_tag_cols(incidents.copy())
+
+    tag_maps = rename_columns(None, return_maps=True)
+    tag_names = ["contributing_tags", "med_error_tags", "measures_tags"]
+    for col_map, tag_name in zip(tag_maps, tag_names):
+        expected = [
+            ", ".join(col for col in col_map.values() if row[col] == 1)
+            for _, row in incidents.iterrows()
+        ]
+        assert list(tagged[tag_name]) == expected
+
+    assert tagged["measures_tags"].str.contains(", ").any()
+
+
+def test_write_site_files_partitions_every_chunk(report_db):
+    create_dir_if_needed(4, 2019)
+    columns = ["Site Name", "Location", "Other Action"]
+    chunks = [
+        pd.DataFrame(
+            [
+                ["PACE Rhode Island - Providence", "Hospital", ""],
+                ["PACE Rhode Island - East Bay", "PACE Center", "Called family"],
+            ],
+            columns=columns,
+        ),
+        pd.DataFrame(
+            [["PACE Rhode Island - Providence", "Participant Home", ""]],
+            columns=columns,
+        ),
+    ]
+
+    write_site_files(chunks, 4, 2019)
+
+    def rows(suffix):
+        path = f"{filepath.filepath}\\2019Q4\\hpms_med_errors_Q4_2019_{suffix}.txt"
+        with open(path, newline="") as upload:
+            return list(csv.reader(upload, delimiter="\t"))
+
+    header = [["IB v2.0"] + [""] * 8, columns]
+    assert rows("pvd") == header + [
+        ["PACE Rhode Island - Providence", "Hospital", ""],
+        ["PACE Rhode Island - Providence", "Participant Home", ""],
+    ]
+    assert rows("east_bay") == header + [
+        ["PACE Rhode Island - East Bay", "PACE Center", "Called family"]
+    ]
+    # registered sites without incidents still get a file to upload
+    assert rows("woon") == header
+    assert rows("wes") == header
@@ -0,0 +1,24 @@
+import sqlite3
+import pytest
+from periods import age_cutoff, shift_date
+
+
+@pytest.mark.parametrize(
+    "date", ["2019-12-31", "2020-02-29", "2020-03-31", "2021-03-01", "2019-06-30"]
+)
+@pytest.mark.parametrize("min_age", [65, 55, 65.5])
+def test_age_cutoff_matches_julianday_age(date, min_age):
+    # members born before the cutoff, and only they, are min_age by the
+    # age the pneumococcal queries used to compute for every row
+    cutoff = age_cutoff(date, min_age)
+    conn = sqlite3.connect(":memory:")
+
+    for days in range(-3, 4):
+        dob = shift_date(cutoff, days=days)
+        age = conn.execute(
+            "SELECT (julianday(?) - julianday(?)) / 365.25", (date, dob)
+        ).fetchone()[0]
+
+        assert (dob < cutoff) == (age >= min_age), dob
+
+    conn.close()
@@ -0,0 +1,70 @@
+import sqlite3
+import pandas as pd
+import pytest
+import pipeline
+
+
+@pytest.fixture
+def locked_error(tmp_path):
+    """Returns the error pandas raises reading a database locked by a writer."""
+    path = str(tmp_path / "locked.db")
+    writer = sqlite3.connect(path)
+    writer.execute("CREATE TABLE enrollment (member_id INTEGER)")
+    writer.commit()
+    writer.execute("BEGIN EXCLUSIVE")
+
+    reader = sqlite3.connect(path, timeout=0)
+    try:
+        pd.read_sql_query("SELECT * FROM enrollment", reader)
+    except Exception as error:
+        return error
+    finally:
+        reader.close()
+        writer.close()
+
+    pytest.fail("Reading the locked database did not fail")
+
+
+def test_database_locked_sqlite_error():
+    assert pipeline.database_locked(sqlite3.OperationalError("database is locked"))
+    assert not pipeline.database_locked(sqlite3.OperationalError("no such table"))
+    assert not pipeline.database_locked(ValueError("Census does not match"))
+
+
+def test_database_locked_wrapped_by_pandas(locked_error):
+    assert not isinstance(locked_error, sqlite3.OperationalError)
+    assert pipeline.database_locked(locked_error)
+
+
+def test_run_stages_retries_wrapped_locked_error(locked_error, monkeypatch):
+    monkeypatch.setattr(pipeline, "lock_retry_seconds", 0)
+    calls = []
+
+    def stage(quarter, year):
+        calls.append(quarter)
+        if len(calls) == 1:
+            raise locked_error
+        return "Complete!"
+
+    results = pipeline.run_stages(
+        [("stage", stage, {"quarter": 1, "year": 2019}, [])], jobs=1
+    )
+
+    assert len(calls) == 2
+    assert results[0][2] == "Complete!"
+
+
+def test_run_stages_gives_up_after_lock_retries(locked_error, monkeypatch):
+    monkeypatch.setattr(pipeline, "lock_retry_seconds", 0)
+    calls = []
+
+    def stage(quarter, year):
+        calls.append(quarter)
+        raise locked_error
+
+    results = pipeline.run_stages(
+        [("stage", stage, {"quarter": 1, "year": 2019}, [])], jobs=1
+    )
+
+    assert len(calls) == pipeline.lock_retries + 1
+    assert results[0][2] is locked_error
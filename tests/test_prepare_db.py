@@ -0,0 +1,55 @@
+import pytest
+import prepare_db
+from prepare_db import create_change_log, create_indexes, full_scans, unbounded_search
+
+
+def test_report_queries_use_indexes(report_db):
+    scanned = {name for name, detail in full_scans(report_db)}
+    assert {"enrollment_frame", "vaccination_frame pneumo"} <= scanned
+
+    create_indexes(report_db)
+    assert full_scans(report_db) == []
+
+    # the change log queries are only checked once the log exists
+    create_change_log(report_db)
+    assert full_scans(report_db) == []
+    assert create_indexes(report_db) == []
+
+
+@pytest.mark.parametrize(
+    "detail, unbounded",
+    [
+        ("SEARCH e USING INDEX idx (enrollment_date<?)", True),
+        (
+            "SEARCH e USING INDEX idx (ANY(disenrollment_date) AND enrollment_date<?)",
+            True,
+        ),
+        ("SEARCH e USING INDEX idx (<expr><?)", True),
+        ("SEARCH e USING INDEX idx (member_id=? AND enrollment_date<?)", False),
+        ("SEARCH e USING INDEX idx (disenrollment_date>?)", False),
+        ("SEARCH m USING INDEX idx (date_discovered>? AND date_discovered<?)", False),
+        ("SEARCH d USING INTEGER PRIMARY KEY (rowid=?) LEFT-JOIN", False),
+    ],
+)
+def test_unbounded_search(detail, unbounded):
+    assert unbounded_search(detail) == unbounded
+
+
+def test_upper_bound_on_enrollment_date_is_a_full_scan(report_db, monkeypatch):
+    # reading the period off an enrollment_date index reads every record
+    # enrolled before the end of the period
+    create_indexes(report_db)
+    monkeypatch.setattr(
+        prepare_db,
+        "report_queries",
+        lambda change_log=True: [
+            (
+                "enrollment_frame",
+                """SELECT member_id FROM enrollment WHERE enrollment_date <= ?
+                AND (disenrollment_date >= ? OR disenrollment_date IS NULL)""",
+                ["2019-03-31", "2019-01-01"],
+            )
+        ],
+    )
+
+    assert [name for name, detail in full_scans(report_db)] == ["enrollment_frame"]
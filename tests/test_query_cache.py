@@ -0,0 +1,95 @@
+import os
+import pytest
+import query_cache
+from query_cache import cache_key, cache_stats, cached, db_version
+
+
+@pytest.fixture
+def cache(report_db):
+    """Turns the query cache on for the report database copy."""
+    query_cache.enabled = True
+
+    yield report_db
+
+    query_cache.close_cache()
+
+
+def counted(result):
+    """Returns a query function returning result and the list of its runs."""
+    runs = []
+
+    def run():
+        runs.append(result)
+        return result
+
+    return run, runs
+
+
+def test_cache_key_normalizes_whitespace():
+    query = "SELECT member_id FROM enrollment WHERE center = ?"
+
+    spaced = "SELECT member_id\n    FROM enrollment\n  WHERE center = ?"
+
+    assert cache_key("fetchall", query, ["Westerly"]) == cache_key(
+        "fetchall", spaced, ("Westerly",)
+    )
+    assert cache_key("fetchall", query, ["Westerly"]) != cache_key(
+        "fetchall", query, ["Providence"]
+    )
+    assert cache_key("fetchall", query, []) != cache_key("dataframe", query, [])
+
+
+def test_db_version_follows_modified_time_and_size(tmp_path):
+    path = tmp_path / "report.db"
+    path.write_bytes(b"x" * 10)
+    stat = os.stat(path)
+    version = db_version(str(path))
+
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    touched = db_version(str(path))
+    assert touched != version
+
+    with open(path, "ab") as db_file:
+        db_file.write(b"x")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert db_version(str(path)) not in (version, touched)
+
+
+def test_result_cached_until_database_changes(cache):
+    run, runs = counted([(1,)])
+    stats = cache_stats()
+
+    assert cached("fetchall", "SELECT 1", (), run) == [(1,)]
+    assert cached("fetchall", "SELECT 1", (), run) == [(1,)]
+    assert len(runs) == 1
+    assert cache_stats()["cache_hits"] == stats["cache_hits"] + 1
+    assert cache_stats()["cache_misses"] == stats["cache_misses"] + 1
+
+    stat = os.stat(cache)
+    os.utime(cache, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert cached("fetchall", "SELECT 1", (), run) == [(1,)]
+    assert len(runs) == 2
+
+
+def test_least_recently_used_results_evicted(cache, monkeypatch):
+    results = {query: "x" * 1000 for query in ["SELECT 1", "SELECT 2", "SELECT 3"]}
+    monkeypatch.setattr(query_cache, "max_bytes", 2500)
+    evictions = cache_stats()["cache_evictions"]
+
+    for query in ["SELECT 1", "SELECT 2"]:
+        cached("fetchall", query, (), counted(results[query])[0])
+
+    # reading the first result makes the second the least recently used
+    run, runs = counted(results["SELECT 1"])
+    cached("fetchall", "SELECT 1", (), run)
+    cached("fetchall", "SELECT 3", (), counted(results["SELECT 3"])[0])
+
+    assert cache_stats()["cache_evictions"] == evictions + 1
+
+    cached("fetchall", "SELECT 1", (), run)
+    assert runs == []
+
+    run, runs = counted(results["SELECT 2"])
+    cached("fetchall", "SELECT 2", (), run)
+    assert len(runs) == 1
@@ -0,0 +1,55 @@
+import sqlite3
+from conftest import quarter_dates
+from sites import report_centers, site_file_suffix, site_name
+from vaccination import classify_frame, vaccination_frame
+
+
+def add_centers(db_filepath):
+    conn = sqlite3.connect(db_filepath)
+    with conn:
+        conn.executemany(
+            "INSERT INTO enrollment VALUES (?, ?, ?, ?, ?, 1, 1)",
+            [
+                # a new center enrolling during 2019Q4
+                (90010, "2019-11-01", None, None, "East Bay"),
+                # a center closed before 2019Q4
+                (90011, "2015-01-01", "2016-06-30", "Moved", "Newport"),
+            ],
+        )
+        conn.execute("INSERT INTO demographics VALUES (90010, '1940-01-01')")
+        conn.execute("INSERT INTO pneumo VALUES (90010, '2019-11-20', 1)")
+    conn.close()
+
+
+def test_report_centers_lists_registry_then_enrolled_centers(report_db):
+    add_centers(report_db)
+
+    assert report_centers(quarter_dates(4, 2019)) == [
+        "Providence",
+        "Woonsocket",
+        "Westerly",
+        "East Bay",
+    ]
+    assert "East Bay" not in report_centers(quarter_dates(3, 2019))
+
+
+def test_site_names_and_file_suffixes():
+    assert site_name("Woonsocket") == "PACE Rhode Island - Woonsocket"
+    assert site_file_suffix(site_name("Providence")) == "pvd"
+    assert site_file_suffix(site_name("Woonsocket")) == "woon"
+    assert site_file_suffix(site_name("Westerly")) == "wes"
+
+    # centers missing from the registry are named after the organization
+    assert site_name("East Bay") == "PACE Rhode Island - East Bay"
+    assert site_file_suffix(site_name("East Bay")) == "east_bay"
+
+
+def test_discovered_center_classified(report_db):
+    add_centers(report_db)
+    params = quarter_dates(4, 2019)
+    frame = vaccination_frame("pneumo", params, min_age=65)
+
+    center_buckets = classify_frame(frame, params, report_centers(params), min_age=65)
+
+    assert list(center_buckets["East Bay"]["during"]) == [90010]
+    assert 90010 not in center_buckets["Providence"]["eligible"]
@@ -0,0 +1,170 @@
+import sqlite3
+import pytest
+import status_store
+from conftest import quarter_dates
+from enrollment import double_check, organization_totals, stored_enrollment_data
+from prepare_db import create_change_log
+from test_enrollment import assert_matches_center_enrollment
+from test_vaccination import assert_matches_baseline, centers
+from vaccination import stored_buckets, vaccination_window
+
+vaccination_tables = ["enrollment", "demographics", "pneumo"]
+
+
+@pytest.fixture(params=[True, False], ids=["change_log", "no_change_log"])
+def store_db(request, report_db):
+    """Turns the status store on, with and without the change log."""
+    if request.param:
+        create_change_log(report_db)
+    status_store.enabled = True
+
+    return report_db
+
+
+def execute(db_filepath, *queries):
+    """Runs the queries in one transaction on a writable connection."""
+    conn = sqlite3.connect(db_filepath)
+    with conn:
+        for query in queries:
+            conn.execute(query)
+    conn.close()
+
+
+def changed_pneumo_members(params):
+    return status_store.changed_members(
+        "pneumo", status_store.period_key(params), vaccination_tables
+    )[0]
+
+
+@pytest.mark.parametrize("table", ["pneumo", "influ"])
+def test_stored_buckets_follow_inserts_and_updates(store_db, table):
+    params = quarter_dates(4, 2019)
+    if table == "pneumo":
+        options = {"min_age": 65}
+    else:
+        options = {"prior_months": 2, "window": vaccination_window(params, 2)}
+
+    def stored():
+        return stored_buckets(table, params, centers, **options)
+
+    assert_matches_baseline(store_db, table, params, stored())
+
+    execute(
+        store_db,
+        # a new member and a new vaccination of an existing one
+        "INSERT INTO enrollment VALUES "
+        "(90010, '2019-10-05', NULL, NULL, 'Providence', 1, 1)",
+        "INSERT INTO demographics VALUES (90010, '1935-01-01')",
+        f"INSERT INTO {table} VALUES (90010, '2019-10-06', 1)",
+        f"INSERT INTO {table} VALUES (1, '2019-11-06', 0)",
+    )
+    assert_matches_baseline(store_db, table, params, stored())
+
+    execute(
+        store_db,
+        # refusals corrected, a disenrollment and a birth date filled in,
+        # vaccinating contraindicated members fails the missed check
+        f"""UPDATE {table} SET dose_status = 1 WHERE dose_status = 0
+        AND date_administered BETWEEN '2019-10-01' AND '2019-12-31'
+        AND member_id NOT IN
+        (SELECT member_id FROM {table} WHERE dose_status = 99)""",
+        """UPDATE enrollment SET disenrollment_date = '2019-09-30',
+        disenroll_type = 'Deceased' WHERE rowid IN (SELECT rowid FROM enrollment
+        WHERE disenrollment_date IS NULL AND center = 'Westerly' LIMIT 5)""",
+        "UPDATE demographics SET dob = '1931-01-01' WHERE member_id = 90003",
+    )
+    assert_matches_baseline(store_db, table, params, stored())
+
+    # a deleted vaccination
+    execute(store_db, f"DELETE FROM {table} WHERE member_id = 90001")
+    assert_matches_baseline(store_db, table, params, stored())
+
+
+def test_stored_enrollment_follows_inserts_and_updates(store_db):
+    params = quarter_dates(4, 2019)
+
+    def check():
+        enrollment_df = stored_enrollment_data(params)
+        assert_matches_center_enrollment(store_db, params, enrollment_df)
+        assert double_check(enrollment_df, organization_totals(params))
+
+    check()
+
+    execute(
+        store_db,
+        # a new member and a transfer of an existing one
+        "INSERT INTO enrollment VALUES "
+        "(90010, '2019-10-05', NULL, NULL, 'Providence', 1, 1)",
+        "INSERT INTO enrollment VALUES "
+        "(90003, '2019-12-02', NULL, NULL, 'Woonsocket', 0, 1)",
+    )
+    check()
+
+    execute(
+        store_db,
+        # the transfer's old enrollment ends and members disenroll in place
+        """UPDATE enrollment SET disenrollment_date = '2019-12-01',
+        disenroll_type = 'Moved' WHERE member_id = 90003
+        AND center = 'Providence'""",
+        """UPDATE enrollment SET disenrollment_date = '2019-11-30',
+        disenroll_type = 'Deceased' WHERE rowid IN (SELECT rowid FROM enrollment
+        WHERE disenrollment_date IS NULL AND center = 'Westerly' LIMIT 5)""",
+        "UPDATE enrollment SET medicare = 0 WHERE member_id = 90010",
+    )
+    check()
+
+
+def test_change_log_finds_changed_members(report_db):
+    create_change_log(report_db)
+    params = quarter_dates(4, 2019)
+    stored_buckets("pneumo", params, centers, min_age=65)
+
+    assert changed_pneumo_members(params) == set()
+
+    execute(
+        report_db,
+        # a refusal corrected in place, a birth date of a member below
+        # the highest member id and a deleted enrollment
+        "UPDATE pneumo SET dose_status = 1 WHERE member_id = 90002",
+        "DELETE FROM demographics WHERE member_id = 7",
+        "INSERT INTO demographics VALUES (7, '1930-01-01')",
+        "DELETE FROM enrollment WHERE member_id = 90004",
+        # changes to tables the category does not read
+        "UPDATE influ SET dose_status = 1 WHERE member_id = 90002",
+    )
+
+    assert changed_pneumo_members(params) == {7, 90002, 90004}
+
+
+def test_any_change_reclassifies_without_change_log(report_db):
+    params = quarter_dates(4, 2019)
+    stored_buckets("pneumo", params, centers, min_age=65)
+
+    assert changed_pneumo_members(params) == set()
+
+    execute(report_db, "UPDATE influ SET dose_status = 1 WHERE member_id = 90002")
+
+    assert changed_pneumo_members(params) is None
+
+
+def test_tables_marked_once_per_database_version(report_db):
+    create_change_log(report_db)
+    queries = []
+
+    def fetch(query, params=()):
+        queries.append(query)
+        conn = sqlite3.connect(report_db)
+        try:
+            return conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+
+    mark = status_store.table_mark("pneumo", fetch)
+    assert status_store.table_mark("pneumo", fetch) == mark
+    marked = len(queries)
+    assert marked > 0
+
+    execute(report_db, "INSERT INTO pneumo VALUES (1, '2019-11-06', 0)")
+
+    assert status_store.table_mark("pneumo", fetch) > mark
+    assert len(queries) == 2 * marked
@@ -0,0 +1,179 @@
+import sqlite3
+import pytest
+from conftest import quarter_dates, quarters
+from vaccination import (
+    classify_frame,
+    vaccination_frame,
+    vaccination_window,
+)
+
+centers = ["Providence", "Woonsocket", "Westerly"]
+
+# the per-bucket queries the reports ran before classify_frame, with the
+# age filter of the pneumococcal report
+baseline_query = """
+    SELECT DISTINCT(e.member_id){age}
+    FROM enrollment e
+    {vaccination_join}
+    {age_join}
+    WHERE {age_filter}(disenrollment_date >=?
+    OR disenrollment_date IS NULL)
+    AND enrollment_date <= ?
+    {condition}
+    AND e.center = ?
+    """
+
+during = "AND date_administered BETWEEN ? AND date(?, '+1 day')"
+
+baseline_conditions = {
+    "pneumo": {
+        "during": ("AND dose_status = 1 " + during, 2),
+        "prior": ("AND dose_status = 1 AND date_administered < ?", 1),
+        "refused_during": ("AND dose_status = 0 " + during, 2),
+        "refused_prior": ("AND dose_status = 0 AND date_administered < ?", 1),
+        "contra": ("AND dose_status = 99", 0),
+    },
+    "influ": {
+        "during": ("AND dose_status = 1 " + during, 2),
+        "prior": (
+            "AND dose_status = 1 "
+            "AND date_administered BETWEEN date(?, '-2 months') AND ?",
+            -1,
+        ),
+        "refused_during": ("AND dose_status = 0 " + during, 2),
+        "contra": ("AND dose_status = 99", 0),
+    },
+}
+
+
+def baseline_members(conn, table, params, center, bucket=None):
+    """Runs one of the original bucket queries, bucket None for eligible."""
+    pneumo = table == "pneumo"
+    condition, dates = baseline_conditions[table].get(bucket, ("", 0))
+
+    query = baseline_query.format(
+        age=", ((julianday(?) - julianday(d.dob)) / 365.25) as age" if pneumo else "",
+        vaccination_join=(
+            f"LEFT JOIN {table} v on e.member_id = v.member_id" if bucket else ""
+        ),
+        age_join=(
+            f"LEFT JOIN demographics d ON {'v' if bucket else 'e'}.member_id=d.member_id"
+            if pneumo
+            else ""
+        ),
+        age_filter="age >=65 AND " if pneumo else "",
+        condition=condition,
+    )
+
+    query_params = [params[1]] if pneumo else []
+    query_params += list(params)
+    query_params += {0: [], 1: [params[0]], 2: list(params), -1: [params[0]] * 2}[
+        dates
+    ]
+
+    return [row[0] for row in conn.execute(query, query_params + [center])]
+
+
+def baseline_buckets(conn, table, params, center):
+    """Buckets the members of a center the way the original reports did."""
+    eligible = baseline_members(conn, table, params, center)
+    during_ppts = baseline_members(conn, table, params, center, "during")
+
+    prior_vaccs = baseline_members(conn, table, params, center, "prior")
+    prior_ppts = [mem_id for mem_id in prior_vaccs if mem_id not in during_ppts]
+
+    contra_ppts = baseline_members(conn, table, params, center, "contra")
+    recieved_or_alergic = prior_ppts + during_ppts + contra_ppts
+
+    refused_vacc = baseline_members(conn, table, params, center, "refused_during")
+    refused_ppts = [
+        mem_id for mem_id in refused_vacc if mem_id not in recieved_or_alergic
+    ]
+
+    all_in_vacc = recieved_or_alergic + refused_ppts
+    missed = [mem_id for mem_id in eligible if mem_id not in all_in_vacc]
+
+    buckets = {
+        "eligible": eligible,
+        "during": during_ppts,
+        "prior": prior_ppts,
+        "refused": refused_ppts,
+        "contra": contra_ppts,
+        "missed": missed,
+    }
+
+    if table == "pneumo":
+        refused_prior = baseline_members(conn, table, params, center, "refused_prior")
+        buckets["missed_actual"] = [
+            mem_id for mem_id in missed if mem_id not in refused_prior
+        ]
+
+    return {bucket: sorted(members) for bucket, members in buckets.items()}
+
+
+def assert_matches_baseline(db_filepath, table, params, center_buckets):
+    conn = sqlite3.connect(db_filepath)
+    try:
+        for center in centers:
+            expected = baseline_buckets(conn, table, params, center)
+            for bucket, members in expected.items():
+                assert sorted(center_buckets[center][bucket].tolist()) == members, (
+                    center,
+                    bucket,
+                )
+    finally:
+        conn.close()
+
+
+def classify(table, params):
+    """Classifies the period the way pneumo_vacc and influ_vacc do."""
+    if table == "pneumo":
+        frame = vaccination_frame("pneumo", params, min_age=65)
+        return classify_frame(frame, params, centers, min_age=65)
+
+    frame = vaccination_frame("influ", params, window=vaccination_window(params, 2))
+    return classify_frame(frame, params, centers, prior_months=2)
+
+
+@pytest.mark.parametrize("table", ["pneumo", "influ"])
+@pytest.mark.parametrize("quarter, year", quarters)
+def test_classify_frame_matches_bucket_queries(report_db, table, quarter, year):
+    params = quarter_dates(quarter, year)
+
+    assert_matches_baseline(report_db, table, params, classify(table, params))
+
+
+@pytest.mark.parametrize("table", ["pneumo", "influ"])
+def test_classify_frame_of_longer_period(report_db, table):
+    # a backfill classifies every quarter from one frame of the whole range
+    min_age = 65 if table == "pneumo" else None
+    frame = vaccination_frame(
+        table, (quarter_dates(1, 2018)[0], quarter_dates(4, 2019)[1]), min_age
+    )
+
+    for quarter, year in quarters:
+        params = quarter_dates(quarter, year)
+        prior_months = None if table == "pneumo" else 2
+        center_buckets = classify_frame(frame, params, centers, prior_months, min_age)
+
+        assert_matches_baseline(report_db, table, params, center_buckets)
+
+
+def test_edge_case_members(report_db):
+    params = quarter_dates(4, 2019)
+    pneumo = classify("pneumo", params)
+    influ = classify("influ", params)
+
+    # counted at both centers after moving
+    assert 90001 in pneumo["Providence"]["eligible"]
+    assert 90001 in pneumo["Westerly"]["during"]
+    # counted once at the center re-enrolled at
+    assert list(influ["Woonsocket"]["refused"]).count(90002) == 1
+    # without a birth date a member is never old enough
+    assert 90003 not in pneumo["Providence"]["eligible"]
+    assert 90004 not in pneumo["Westerly"]["eligible"]
+    assert 90003 in influ["Providence"]["during"]
+    # contraindicated wins over a refusal or vaccination
+    assert 90005 in pneumo["Woonsocket"]["contra"]
+    assert 90005 not in pneumo["Woonsocket"]["refused"]
+    assert 90005 in influ["Woonsocket"]["contra"]
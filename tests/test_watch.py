@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import pytest
+import filepath
+from pipeline import stage_registry
+from prepare_db import create_change_log
+from watch import affected_stages, table_marks, watched_tables
+
+
+def update(db_filepath, query):
+    """Runs the query and moves the file version on, like a later write."""
+    conn = sqlite3.connect(db_filepath)
+    with conn:
+        conn.execute(query)
+    conn.close()
+
+    stat = os.stat(db_filepath)
+    os.utime(db_filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_watched_tables_lists_every_stage_table():
+    assert watched_tables() == [
+        "centers",
+        "demographics",
+        "enrollment",
+        "influ",
+        "med_errors",
+        "pneumo",
+        "ppts",
+    ]
+
+
+def test_affected_stages(monkeypatch):
+    assert affected_stages([]) == set()
+    assert affected_stages(["pneumo"]) == {"pneumo_vacc"}
+    assert affected_stages(["influ", "centers"]) == {
+        "influ_vacc",
+        "flu_season_report",
+        "med_errors",
+    }
+    assert "output_folders" not in affected_stages(watched_tables())
+
+    # a stage without its tables listed runs on every change
+    stage = dict(stage_registry["output_folders"], tables=None)
+    monkeypatch.setitem(stage_registry, "hand_edits", stage)
+    assert affected_stages([]) == {"hand_edits"}
+    assert affected_stages(["ppts"]) == {"hand_edits", "pneumo_vacc", "influ_vacc"}
+
+
+@pytest.mark.parametrize("change_log", [True, False], ids=["change_log", "no_log"])
+def test_table_marks_move_with_changed_tables(report_db, change_log):
+    if change_log:
+        create_change_log(report_db)
+    tables = watched_tables()
+
+    conn = sqlite3.connect(report_db)
+    marks = table_marks(conn, tables)
+    update(report_db, "UPDATE pneumo SET dose_status = 1 WHERE member_id = 90001")
+    changed = table_marks(conn, tables)
+    conn.close()
+
+    changed_tables = [table for table in tables if changed[table] != marks[table]]
+    if change_log:
+        assert changed_tables == ["pneumo"]
+        assert affected_stages(changed_tables) == {"pneumo_vacc"}
+    else:
+        # without the change log any change marks every table
+        assert changed_tables == tables
+
+
+def test_unreadable_table_marked_none(tmp_path, monkeypatch):
+    path = tmp_path / "report.db"
+    path.write_bytes(b"not a database" * 100)
+    monkeypatch.setattr(filepath, "db_filepath", str(path))
+
+    conn = sqlite3.connect(str(path))
+    assert table_marks(conn, ["enrollment"]) == {"enrollment": None}
+    conn.close()